@@ -2,6 +2,9 @@
 Servidor TCP concurrente (con hilos) para gestionar calificaciones con validación de NRC.
 
 - Puerto: 127.0.0.1:12345
+- Cada conexión se atiende en un pool fijo de hilos (ThreadPoolExecutor) creado al iniciar.
+  Una conexión sin actividad durante IDLE_TIMEOUT segundos, o cuya línea no llega completa
+  en LINE_TIMEOUT segundos o supera MAX_LINE bytes, se cierra y libera su hilo.
 - Protocolo de texto por línea con comandos:
   AGREGAR|{id}|{nombre}|{materia}|{calificacion}
   BUSCAR|{id}
@@ -9,56 +12,228 @@ Servidor TCP concurrente (con hilos) para gestionar calificaciones con validaci
   LISTAR
   ELIMINAR|{id}
 
-- Respuestas como JSON por línea.
+- Respuestas como JSON por línea; un cliente puede enviar varias líneas por conexión.
 - Persistencia en laboratorio_2/calificaciones.csv (encabezados: ID_Estudiante,Nombre,Materia,Calificacion).
 - Validación de Materia (NRC) al AGREGAR consultando al microservicio NRC (127.0.0.1:12346):
     BUSCAR_NRC|{nrc} → {status: "ok", data: {...}} o {status: "not_found"}
-- Protección de acceso al CSV mediante threading.Lock.
+  Si el NRC está en nrcs.csv (misma carpeta que el microservicio) se valida localmente sin
+  consultar por red. Las conexiones al microservicio se reutilizan desde un pool (keep-alive,
+  TCP_NODELAY) y las respuestas "ok" se cachean NRC_CACHE_TTL segundos.
+- Protección de acceso al CSV mediante un lock lectores/escritor (RWLock): BUSCAR y LISTAR
+  se atienden en paralelo; AGREGAR, ACTUALIZAR y ELIMINAR toman el lock exclusivo.
+- Índice en memoria {(ID_Estudiante, Materia) -> Record} cargado una sola vez al iniciar:
+  AGREGAR agrega una línea al final del CSV; ACTUALIZAR/ELIMINAR agregan una línea al journal
+  (calificaciones.log), que se aplica al iniciar. El CSV se reescribe completo (compactación)
+  tras COMPACT_THRESHOLD cambios o al detener el servidor, y entonces se borra el journal.
+  La escritura de CSV y journal está en persistencia.py, compartido con sin_hilos.
 
 Uso:
     python3 server.py
 
-Requisitos: Python 3.9+, librerías estándar (socket, csv, json, threading).
+Requisitos: Python 3.9+, librerías estándar (socket, csv, json, logging, threading, concurrent.futures).
+  Si orjson está instalado se usa para serializar las respuestas; si no, json.
 """
 from __future__ import annotations
 
 import csv
+import io
 import json
+import logging
+import logging.handlers
+import os
+import queue
 import socket
 import sys
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+# persistencia.py está en la carpeta del laboratorio, junto a nrcs_server.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from persistencia import Persistencia  # noqa: E402
 
 HOST = "127.0.0.1"
 PORT = 12345
+MAX_WORKERS = (os.cpu_count() or 1) * 4
+# Límites por conexión para que un cliente no se quede con un hilo del pool: segundos de
+# espera del primer byte de una línea, segundos para que esa línea llegue completa (un
+# cliente que envía un byte cada tanto no renueva el plazo) y bytes máximos por línea
+IDLE_TIMEOUT = 10.0
+LINE_TIMEOUT = 5.0
+MAX_LINE = 64 * 1024
+LISTEN_BACKLOG = 128
+RECV_SIZE = 65536
 
 # Microservicio NRC
 NRC_HOST = "127.0.0.1"
 NRC_PORT = 12346
+NRC_POOL_SIZE = 8
+NRC_CACHE_TTL = 60.0  # segundos
 
 # CSV de calificaciones
 CSV_PATH = (Path(__file__).resolve().parents[1] / "calificaciones.csv").resolve()
-# Persistimos solo ID, Materia y Calificacion; Nombre se resuelve por join con estudiantes.csv
-FIELDNAMES = ["ID_Estudiante", "Materia", "Calificacion"]
 ESTUDIANTES_CSV = (Path(__file__).resolve().parents[1] / "estudiantes.csv").resolve()
 ESTUDIANTES_FIELDS = ["ID_Estudiante", "Nombre"]
+# Catálogo de NRC del microservicio (misma carpeta); se lee solo para validar localmente
+NRCS_CSV = (Path(__file__).resolve().parents[1] / "nrcs.csv").resolve()
+
+
+class Record(NamedTuple):
+    """Fila de calificaciones.csv; inmutable, ACTUALIZAR la reemplaza con _replace()."""
 
-# Lock global para proteger acceso R/W al CSV
-CSV_LOCK = threading.Lock()
+    ID_Estudiante: str
+    Materia: str
+    Calificacion: str
 
 
-def log(msg: str) -> None:
-    print(f"[server-hilos] {msg}")
+class RWLock:
+    """Lock lectores/escritor: varios lectores a la vez o un único escritor.
+    Los escritores en espera tienen prioridad para que las lecturas no los posterguen.
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def acquire_read(self) -> Iterator[None]:
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def acquire_write(self) -> Iterator[None]:
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+# Lock global para proteger acceso R/W al CSV y al índice en memoria
+CSV_LOCK = RWLock()
+
+# Índice en memoria de calificaciones: {(ID_Estudiante, Materia) -> Record}
+RECORDS: Dict[Tuple[str, str], Record] = {}
+# ID_Estudiante -> materias, en orden; BUSCAR/ACTUALIZAR/ELIMINAR por ID no recorren RECORDS
+RECORDS_POR_ID: Dict[str, List[str]] = {}
+# Versión del índice: cambia con cada put_record/remove_record
+_RECORDS_VERSION = 0
+# Respuesta de LISTAR ya serializada: (versión del índice, mapa de estudiantes usado, bytes)
+_LISTAR_CACHE: Optional[Tuple[int, Dict[str, str], bytes]] = None
+_RECORDS_LOADED = False
+
+# Pool de hilos que atiende las conexiones durante toda la vida del servidor
+EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="grade")
+# Conexiones abiertas; se cierran al detener el servidor para liberar los hilos del pool
+_CONNS: Set[socket.socket] = set()
+_CONNS_LOCK = threading.Lock()
+
+# Pool de conexiones abiertas al microservicio NRC: (socket, lector bufferizado)
+NrcConn = Tuple[socket.socket, io.BufferedReader]
+_NRC_POOL: "queue.Queue[NrcConn]" = queue.Queue(maxsize=NRC_POOL_SIZE)
+# Caché de respuestas "ok" del microservicio NRC: {nrc -> (expira_en, respuesta)}
+_NRC_CACHE: Dict[str, Tuple[float, Dict]] = {}
+_NRC_CACHE_LOCK = threading.Lock()
+
+# Caché de estudiantes.csv invalidada por mtime; se recarga solo si el archivo cambió
+_EST_CACHE: Dict[str, object] = {"mtime": None, "map": {}}
+_EST_CACHE_LOCK = threading.Lock()
+
+# Caché de nrcs.csv (lectura local, invalidada por mtime): {NRC -> {NRC, Materia}}
+_NRCS_CSV_CACHE: Dict[str, object] = {"mtime": None, "map": {}}
+_NRCS_CSV_CACHE_LOCK = threading.Lock()
+
+# Escritura de logs fuera del camino de las peticiones: el hilo del pool arma el mensaje
+# (QueueHandler.prepare formatea en el hilo que llama) y lo encola; un hilo aparte
+# (QueueListener) solo hace la escritura a stdout, que es la parte que puede bloquear
+LOGGER = logging.getLogger("server-hilos")
+LOGGER.setLevel(logging.INFO)
+LOGGER.propagate = False
+_LOG_QUEUE: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+LOGGER.addHandler(logging.handlers.QueueHandler(_LOG_QUEUE))
+_log_stream = logging.StreamHandler(sys.stdout)
+_log_stream.setFormatter(logging.Formatter("[server-hilos] %(message)s"))
+LOG_LISTENER = logging.handlers.QueueListener(_LOG_QUEUE, _log_stream)
+
+# Serializador JSON compacto creado una sola vez (sin espacios tras ',' y ':'). Con orjson
+# instalado se usa ese: produce los mismos bytes UTF-8 compactos en código nativo
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+# Respuesta de un handler: dict a serializar o bytes ya codificados (JSON + "\n")
+Response = Union[Dict, bytes]
+
+
+def encode_response(resp: Response) -> bytes:
+    """Serializa la respuesta como una línea JSON; las pre-codificadas se devuelven tal cual."""
+    if isinstance(resp, bytes):
+        return resp
+    if orjson is not None:
+        return orjson.dumps(resp, option=orjson.OPT_APPEND_NEWLINE)
+    return _dumps(resp).encode("utf-8") + b"\n"
+
+
+# Respuestas estáticas serializadas una sola vez; los handlers las devuelven tal cual
+ERR_VACIO = encode_response({"status": "error", "message": "Comando vacío"})
+ERR_FORMATO_AGREGAR = encode_response({"status": "error", "message": "Formato inválido para AGREGAR"})
+ERR_FORMATO_BUSCAR = encode_response({"status": "error", "message": "Formato inválido para BUSCAR"})
+ERR_FORMATO_ACTUALIZAR = encode_response({"status": "error", "message": "Formato inválido para ACTUALIZAR (use ID|nueva o ID|Materia|nueva)"})
+ERR_FORMATO_LISTAR = encode_response({"status": "error", "message": "Formato inválido para LISTAR"})
+ERR_FORMATO_ELIMINAR = encode_response({"status": "error", "message": "Formato inválido para ELIMINAR (use ID o ID|Materia)"})
+ERR_ESTUDIANTE_NO_EXISTE = encode_response({"status": "error", "message": "ID_Estudiante no encontrado en estudiantes.csv"})
+ERR_NOTA_EXISTE = encode_response({"status": "error", "message": "La nota para ese ID y Materia ya existe"})
+ERR_VARIAS_NOTAS_ACTUALIZAR = encode_response({"status": "error", "message": "El ID tiene varias notas; use ACTUALIZAR|ID|Materia|nueva"})
+ERR_VARIAS_NOTAS_ELIMINAR = encode_response({"status": "error", "message": "El ID tiene varias notas; especifique Materia (ELIMINAR|ID|Materia)"})
+NOT_FOUND_ID = encode_response({"status": "not_found", "message": "No existe el ID"})
+NOT_FOUND_NOTA = encode_response({"status": "not_found", "message": "No existe nota para ese ID y Materia"})
+
+
+def log(msg: str, *args: object) -> None:
+    """Formatea y encola el mensaje en el hilo que llama; solo la escritura a stdout la hace
+    el hilo de LOG_LISTENER.
+    """
+    LOGGER.info(msg, *args)
+
+
+# CSV y journal en disco (persistencia.py, compartido con sin_hilos); solo se usa con
+# CSV_LOCK tomado en modo escritura
+STORE = Persistencia(CSV_PATH, lambda: list(RECORDS.values()), log)
 
 
 def ensure_csv_exists() -> None:
-    if not CSV_PATH.exists():
-        CSV_PATH.parent.mkdir(parents=True, exist_ok=True)
-        with CSV_PATH.open("w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            writer.writeheader()
-        log(f"CSV creado en: {CSV_PATH}")
+    """Crea el CSV si falta (o le agrega el encabezado si está vacío) y carga RECORDS; tras
+    la primera carga no vuelve a tocar el disco.
+    """
+    if _RECORDS_LOADED:
+        return
+    if STORE.ensure_header():
+        log("Encabezado del CSV escrito en: %s", CSV_PATH)
+    load_records()
 
 
 def ensure_estudiantes_csv_exists() -> None:
@@ -67,94 +242,224 @@ def ensure_estudiantes_csv_exists() -> None:
         with ESTUDIANTES_CSV.open("w", newline="", encoding="utf-8") as f:
             writer = csv.DictWriter(f, fieldnames=ESTUDIANTES_FIELDS)
             writer.writeheader()
-        log(f"CSV estudiantes creado en: {ESTUDIANTES_CSV}")
+        log("CSV estudiantes creado en: %s", ESTUDIANTES_CSV)
+
 
+def load_records() -> None:
+    """Llena RECORDS con una sola pasada por el CSV (se llama una vez al iniciar)."""
+    global _RECORDS_LOADED
+    RECORDS.clear()
+    RECORDS_POR_ID.clear()
+    for sid, materia, calificacion in STORE.read_csv():
+        put_record(Record(sid, materia, calificacion))
+    applied = replay_journal()
+    _RECORDS_LOADED = True
+    log("Índice cargado: %d notas (%d cambios del journal)", len(RECORDS), applied)
 
-def load_records() -> List[Dict[str, str]]:
-    with CSV_PATH.open("r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        return list(reader)
 
+def replay_journal() -> int:
+    """Aplica sobre RECORDS los cambios del journal que no alcanzaron a compactarse.
+    Devuelve cuántas líneas se aplicaron.
+    """
+    ops = STORE.read_journal()
+    for parts in ops:
+        if parts[0] == "D":
+            if (parts[1], parts[2]) in RECORDS:
+                remove_record(parts[1], parts[2])
+        else:
+            put_record(Record(parts[1], parts[2], parts[3]))
+    return len(ops)
 
-def save_records(records: List[Dict[str, str]]) -> None:
-    with CSV_PATH.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-        writer.writeheader()
-        writer.writerows(records)
 
+def put_record(r: Record) -> None:
+    """Inserta o reemplaza una nota en RECORDS manteniendo RECORDS_POR_ID."""
+    global _RECORDS_VERSION
+    _RECORDS_VERSION += 1
+    key = (r.ID_Estudiante, r.Materia)
+    if key not in RECORDS:
+        RECORDS_POR_ID.setdefault(r.ID_Estudiante, []).append(r.Materia)
+    RECORDS[key] = r
 
-def get_estudiante_nombre(student_id: str) -> Optional[str]:
-    """Lee estudiantes.csv y devuelve el nombre si el ID existe, sino None."""
-    ensure_estudiantes_csv_exists()
-    with ESTUDIANTES_CSV.open("r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row.get("ID_Estudiante") == student_id:
-                return row.get("Nombre") or ""
-    return None
+
+def insert_record(r: Record) -> bool:
+    """Inserta la nota solo si (ID, Materia) no existe, con una sola búsqueda en RECORDS
+    (setdefault). Devuelve False si ya existía.
+    """
+    global _RECORDS_VERSION
+    if RECORDS.setdefault((r.ID_Estudiante, r.Materia), r) is not r:
+        return False
+    RECORDS_POR_ID.setdefault(r.ID_Estudiante, []).append(r.Materia)
+    _RECORDS_VERSION += 1
+    return True
+
+
+def remove_record(student_id: str, materia: str) -> None:
+    global _RECORDS_VERSION
+    _RECORDS_VERSION += 1
+    del RECORDS[(student_id, materia)]
+    materias = RECORDS_POR_ID[student_id]
+    materias.remove(materia)
+    if not materias:
+        del RECORDS_POR_ID[student_id]
+
+
+def get_estudiantes_map() -> Dict[str, str]:
+    """Devuelve el mapa {ID_Estudiante -> Nombre} cacheado.
+    Solo vuelve a leer estudiantes.csv cuando cambia su mtime; la lectura no toma lock.
+    """
+    try:
+        mtime = ESTUDIANTES_CSV.stat().st_mtime_ns
+    except FileNotFoundError:
+        ensure_estudiantes_csv_exists()
+        mtime = ESTUDIANTES_CSV.stat().st_mtime_ns
+    if _EST_CACHE["mtime"] != mtime:
+        with _EST_CACHE_LOCK:
+            if _EST_CACHE["mtime"] != mtime:
+                _EST_CACHE["map"] = load_estudiantes_map()
+                _EST_CACHE["mtime"] = mtime
+    return _EST_CACHE["map"]  # type: ignore[return-value]
 
 
 def load_estudiantes_map() -> Dict[str, str]:
-    """Devuelve un mapa {ID_Estudiante -> Nombre} desde estudiantes.csv."""
-    ensure_estudiantes_csv_exists()
+    """Lee estudiantes.csv y construye un mapa {ID_Estudiante -> Nombre}."""
     out: Dict[str, str] = {}
     with ESTUDIANTES_CSV.open("r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        header = next(reader, ["ID_Estudiante", "Nombre"])
+        i_id, i_nom = header.index("ID_Estudiante"), header.index("Nombre")
         for row in reader:
-            sid = row.get("ID_Estudiante")
-            if sid:
-                out[sid] = row.get("Nombre") or ""
+            if len(row) > i_id and row[i_id]:
+                out[row[i_id]] = row[i_nom] if len(row) > i_nom else ""
     return out
 
 
-def recv_line(conn: socket.socket) -> Optional[str]:
-    buffer = bytearray()
-    while True:
-        chunk = conn.recv(1024)
-        if not chunk:
-            break
-        buffer.extend(chunk)
-        if b"\n" in chunk:
-            break
-    if not buffer:
+def join_nombres(rows: Iterable[Record], est_map: Dict[str, str]) -> List[Dict[str, str]]:
+    """Join con estudiantes.csv en una sola pasada: convierte cada Record a dict con su Nombre canónico."""
+    out: List[Dict[str, str]] = []
+    for r in rows:
+        d = r._asdict()
+        nombre = est_map.get(r.ID_Estudiante)
+        if nombre:
+            d["Nombre"] = nombre
+        out.append(d)
+    return out
+
+
+def local_nrc_lookup(nrc: str) -> Optional[Dict[str, str]]:
+    """Busca el NRC directamente en nrcs.csv, cacheado por mtime.
+    Devuelve None si el NRC no está o si el archivo no existe/no se puede leer.
+    """
+    try:
+        mtime = NRCS_CSV.stat().st_mtime_ns
+        if _NRCS_CSV_CACHE["mtime"] != mtime:
+            with _NRCS_CSV_CACHE_LOCK:
+                if _NRCS_CSV_CACHE["mtime"] != mtime:
+                    _NRCS_CSV_CACHE["map"] = load_nrcs_map()
+                    _NRCS_CSV_CACHE["mtime"] = mtime
+    except OSError:
         return None
-    return buffer.split(b"\n", 1)[0].decode("utf-8", errors="replace")
+    return _NRCS_CSV_CACHE["map"].get(nrc)  # type: ignore[attr-defined]
+
+
+def load_nrcs_map() -> Dict[str, Dict[str, str]]:
+    """Lee nrcs.csv como mapa {NRC -> {NRC, Materia}} (mismo formato que responde el microservicio)."""
+    out: Dict[str, Dict[str, str]] = {}
+    with NRCS_CSV.open("r", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, ["NRC", "Materia"])
+        i_nrc, i_mat = header.index("NRC"), header.index("Materia")
+        for row in reader:
+            if len(row) > i_nrc and row[i_nrc]:
+                nrc = row[i_nrc]
+                out[nrc] = {"NRC": nrc, "Materia": row[i_mat] if len(row) > i_mat else ""}
+    return out
+
+
+def _nrc_connect() -> NrcConn:
+    s = socket.create_connection((NRC_HOST, NRC_PORT), timeout=3)
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    return s, s.makefile("rb", buffering=4096)
+
+
+def _nrc_close(nc: NrcConn) -> None:
+    nc[1].close()
+    nc[0].close()
+
+
+def _nrc_request(nc: NrcConn, request: bytes) -> bytes:
+    """Envía una petición por una conexión abierta y lee una línea de respuesta."""
+    nc[0].sendall(request)
+    return nc[1].readline()
 
 
 def consultar_nrc(nrc: str) -> Dict:
     """Consulta al microservicio NRC. Devuelve dict JSON decodificado.
     Posibles resultados: {status: "ok", data: {...}} | {status: "not_found"}
     En caso de error de red, retorna {status: "error", "message": "..."}.
+
+    Reutiliza conexiones del pool; si una conexión reutilizada resulta cerrada por el
+    microservicio se descarta y se reintenta, terminando con una conexión nueva.
+    Solo las respuestas "ok" se guardan en caché (NRC_CACHE_TTL); not_found y errores
+    se consultan siempre.
+
+    Antes de ir por red se busca el NRC en nrcs.csv (local_nrc_lookup); si está ahí no hay
+    viaje al microservicio. Si no está o falta el archivo, se consulta al microservicio.
     """
-    try:
-        with socket.create_connection((NRC_HOST, NRC_PORT), timeout=3) as s:
-            s.sendall((f"BUSCAR_NRC|{nrc}\n").encode("utf-8"))
-            data = b""
-            while True:
-                chunk = s.recv(1024)
-                if not chunk:
-                    break
-                data += chunk
-                if b"\n" in chunk:
-                    break
-    except Exception as e:
-        return {"status": "error", "message": f"NRC service error: {e}"}
+    local = local_nrc_lookup(nrc)
+    if local is not None:
+        return {"status": "ok", "data": local}
 
-    if not data:
-        return {"status": "error", "message": "NRC service sin respuesta"}
+    now = time.monotonic()
+    with _NRC_CACHE_LOCK:
+        cached = _NRC_CACHE.get(nrc)
+    if cached is not None and cached[0] > now:
+        return cached[1]
 
-    line = data.split(b"\n", 1)[0].decode("utf-8", errors="replace")
+    request = (f"BUSCAR_NRC|{nrc}\n").encode("utf-8")
+    while True:
+        try:
+            nc: Optional[NrcConn] = _NRC_POOL.get_nowait()
+            reused = True
+        except queue.Empty:
+            nc, reused = None, False
+        try:
+            if nc is None:
+                nc = _nrc_connect()
+            data = _nrc_request(nc, request)
+        except Exception as e:
+            if nc is not None:
+                _nrc_close(nc)
+            if reused:
+                continue
+            return {"status": "error", "message": f"NRC service error: {e}"}
+        if not data:
+            _nrc_close(nc)
+            if reused:
+                continue
+            return {"status": "error", "message": "NRC service sin respuesta"}
+        try:
+            _NRC_POOL.put_nowait(nc)
+        except queue.Full:
+            _nrc_close(nc)
+        break
+
+    line = data.decode("utf-8", errors="replace").rstrip("\n")
     try:
-        return json.loads(line)
+        resp = json.loads(line)
     except json.JSONDecodeError:
         return {"status": "error", "message": f"NRC JSON inválido: {line}"}
+    if resp.get("status") == "ok":
+        with _NRC_CACHE_LOCK:
+            _NRC_CACHE[nrc] = (now + NRC_CACHE_TTL, resp)
+    return resp
 
 
 # Handlers de comandos
 
-def handle_agregar(parts: List[str]) -> Dict:
+def handle_agregar(parts: List[str]) -> Response:
     if len(parts) != 5:
-        return {"status": "error", "message": "Formato inválido para AGREGAR"}
+        return ERR_FORMATO_AGREGAR
 
     student_id, nombre, materia, calificacion = parts[1], parts[2], parts[3], parts[4]
 
@@ -166,172 +471,242 @@ def handle_agregar(parts: List[str]) -> Dict:
         return {"status": "error", "message": f"NRC no encontrado: {materia}"}
 
     # Validar existencia de estudiante por fuera del lock (lectura independiente)
-    nombre_canonico = get_estudiante_nombre(student_id)
+    nombre_canonico = get_estudiantes_map().get(student_id)
     if nombre_canonico is None:
-        return {"status": "error", "message": "ID_Estudiante no encontrado en estudiantes.csv"}
+        return ERR_ESTUDIANTE_NO_EXISTE
 
-    with CSV_LOCK:
+    with CSV_LOCK.acquire_write():
         ensure_csv_exists()
-        records = load_records()
-        # Unicidad por par (ID_Estudiante, Materia)
-        if any(r["ID_Estudiante"] == student_id and r.get("Materia") == materia for r in records):
-            return {"status": "error", "message": "La nota para ese ID y Materia ya existe"}
-        new_row = {
-            "ID_Estudiante": student_id,
-            "Materia": materia,
-            "Calificacion": calificacion,
-        }
-        records.append(new_row)
-        save_records(records)
-        log(f"AGREGADO: {new_row} (nombre canónico: {nombre_canonico})")
-        resp_data = dict(new_row)
+        # Unicidad por par (ID_Estudiante, Materia): se verifica e inserta en un solo paso
+        new_row = Record(student_id, materia, calificacion)
+        if not insert_record(new_row):
+            return ERR_NOTA_EXISTE
+        try:
+            journaled = STORE.persist_agregar(new_row)
+        except OSError:
+            # La fila no llegó a disco: se deshace la inserción para que RECORDS no diverja
+            remove_record(student_id, materia)
+            raise
+        if journaled:
+            STORE.mark_dirty()
+        log("AGREGADO: %s (nombre canónico: %s)", new_row, nombre_canonico)
+        resp_data = new_row._asdict()
         resp_data["Nombre"] = nombre_canonico
         return {"status": "ok", "data": resp_data}
 
 
-def handle_buscar(parts: List[str]) -> Dict:
+def handle_buscar(parts: List[str]) -> Response:
     if len(parts) != 2:
-        return {"status": "error", "message": "Formato inválido para BUSCAR"}
+        return ERR_FORMATO_BUSCAR
     student_id = parts[1]
-    with CSV_LOCK:
+    est_map = get_estudiantes_map()
+    with CSV_LOCK.acquire_read():
         ensure_csv_exists()
-        rows = [dict(r) for r in load_records() if r.get("ID_Estudiante") == student_id]
-    if not rows:
-        return {"status": "not_found", "message": "No existe el ID"}
-    # Enriquecer todas con nombre canónico
-    est_map = load_estudiantes_map()
-    nombre_canon = est_map.get(student_id)
-    if nombre_canon:
-        for rr in rows:
-            rr["Nombre"] = nombre_canon
-    return {"status": "ok", "data": rows}
-
-
-def handle_actualizar(parts: List[str]) -> Dict:
+        materias = RECORDS_POR_ID.get(student_id)
+        if not materias:
+            return NOT_FOUND_ID
+        found = [RECORDS[(student_id, m)] for m in materias]
+    # Los Record son inmutables: el join se hace fuera del lock
+    return {"status": "ok", "data": join_nombres(found, est_map)}
+
+
+def handle_actualizar(parts: List[str]) -> Response:
     if len(parts) not in (3, 4):
-        return {"status": "error", "message": "Formato inválido para ACTUALIZAR (use ID|nueva o ID|Materia|nueva)"}
+        return ERR_FORMATO_ACTUALIZAR
     student_id = parts[1]
     if len(parts) == 4:
         materia, nueva_cal = parts[2], parts[3]
-        with CSV_LOCK:
+        with CSV_LOCK.acquire_write():
             ensure_csv_exists()
-            records = load_records()
-            updated = False
-            for r in records:
-                if r["ID_Estudiante"] == student_id and r.get("Materia") == materia:
-                    r["Calificacion"] = nueva_cal
-                    updated = True
-                    break
-            if not updated:
-                return {"status": "not_found", "message": "No existe nota para ese ID y Materia"}
-            save_records(records)
-        log(f"ACTUALIZADO: ID={student_id}, Materia={materia}, nueva_cal={nueva_cal}")
+            r = RECORDS.get((student_id, materia))
+            if r is None:
+                return NOT_FOUND_NOTA
+            # Primero a disco: si el write falla, RECORDS queda como estaba
+            STORE.journal_append("U", student_id, materia, nueva_cal)
+            put_record(r._replace(Calificacion=nueva_cal))
+            STORE.mark_dirty()
+        log("ACTUALIZADO: ID=%s, Materia=%s, nueva_cal=%s", student_id, materia, nueva_cal)
         return {"status": "ok", "data": {"ID_Estudiante": student_id, "Materia": materia, "Calificacion": nueva_cal}}
     else:
         nueva_cal = parts[2]
-        with CSV_LOCK:
+        with CSV_LOCK.acquire_write():
             ensure_csv_exists()
-            records = load_records()
-            notas_id = [r for r in records if r.get("ID_Estudiante") == student_id]
-            if not notas_id:
-                return {"status": "not_found", "message": "No existe el ID"}
-            if len(notas_id) > 1:
-                return {"status": "error", "message": "El ID tiene varias notas; use ACTUALIZAR|ID|Materia|nueva"}
-            materia = notas_id[0].get("Materia")
-            for r in records:
-                if r["ID_Estudiante"] == student_id and r.get("Materia") == materia:
-                    r["Calificacion"] = nueva_cal
-                    break
-            save_records(records)
-        log(f"ACTUALIZADO: ID={student_id}, Materia={materia}, nueva_cal={nueva_cal}")
+            materias = RECORDS_POR_ID.get(student_id)
+            if not materias:
+                return NOT_FOUND_ID
+            if len(materias) > 1:
+                return ERR_VARIAS_NOTAS_ACTUALIZAR
+            materia = materias[0]
+            STORE.journal_append("U", student_id, materia, nueva_cal)
+            put_record(RECORDS[(student_id, materia)]._replace(Calificacion=nueva_cal))
+            STORE.mark_dirty()
+        log("ACTUALIZADO: ID=%s, Materia=%s, nueva_cal=%s", student_id, materia, nueva_cal)
         return {"status": "ok", "data": {"ID_Estudiante": student_id, "Materia": materia, "Calificacion": nueva_cal}}
 
 
-def handle_listar(parts: List[str]) -> Dict:
+def handle_listar(parts: List[str]) -> Response:
     if len(parts) != 1:
-        return {"status": "error", "message": "Formato inválido para LISTAR"}
-    with CSV_LOCK:
+        return ERR_FORMATO_LISTAR
+    global _LISTAR_CACHE
+    est_map = get_estudiantes_map()
+    with CSV_LOCK.acquire_read():
         ensure_csv_exists()
-        rows = load_records()
-    # Join con estudiantes.csv para devolver nombre canónico
-    est_map = load_estudiantes_map()
-    enriched: List[Dict[str, str]] = []
-    for r in rows:
-        rr = dict(r)
-        sid = rr.get("ID_Estudiante", "")
-        nombre_canon = est_map.get(sid)
-        if nombre_canon:
-            rr["Nombre"] = nombre_canon
-        enriched.append(rr)
-    return {"status": "ok", "data": enriched}
-
-
-def handle_eliminar(parts: List[str]) -> Dict:
+        version = _RECORDS_VERSION
+        cached = _LISTAR_CACHE
+        # Sirve la respuesta serializada si no cambió el índice ni estudiantes.csv
+        # (get_estudiantes_map devuelve el mismo dict mientras no cambie el mtime)
+        if cached is not None and cached[0] == version and cached[1] is est_map:
+            return cached[2]
+        snapshot = list(RECORDS.values())
+    payload = encode_response({"status": "ok", "data": join_nombres(snapshot, est_map)})
+    # Se guarda con la versión del snapshot: si hubo un cambio entretanto, no se vuelve a servir
+    _LISTAR_CACHE = (version, est_map, payload)
+    return payload
+
+
+def handle_eliminar(parts: List[str]) -> Response:
     if len(parts) not in (2, 3):
-        return {"status": "error", "message": "Formato inválido para ELIMINAR (use ID o ID|Materia)"}
+        return ERR_FORMATO_ELIMINAR
     student_id = parts[1]
     materia = parts[2] if len(parts) == 3 else None
-    with CSV_LOCK:
+    with CSV_LOCK.acquire_write():
         ensure_csv_exists()
-        records = load_records()
         if materia:
-            new_records = [r for r in records if not (r.get("ID_Estudiante") == student_id and r.get("Materia") == materia)]
-            if len(new_records) == len(records):
-                return {"status": "not_found", "message": "No existe nota para ese ID y Materia"}
-            save_records(new_records)
+            if (student_id, materia) not in RECORDS:
+                return NOT_FOUND_NOTA
+            # Primero a disco: si el write falla, RECORDS queda como estaba
+            STORE.journal_append("D", student_id, materia)
+            remove_record(student_id, materia)
+            STORE.mark_dirty()
         else:
-            notas_id = [r for r in records if r.get("ID_Estudiante") == student_id]
-            if not notas_id:
-                return {"status": "not_found", "message": "No existe el ID"}
-            if len(notas_id) > 1:
-                return {"status": "error", "message": "El ID tiene varias notas; especifique Materia (ELIMINAR|ID|Materia)"}
-            unica_materia = notas_id[0].get("Materia")
-            new_records = [r for r in records if not (r.get("ID_Estudiante") == student_id and r.get("Materia") == unica_materia)]
-            save_records(new_records)
+            materias = RECORDS_POR_ID.get(student_id)
+            if not materias:
+                return NOT_FOUND_ID
+            if len(materias) > 1:
+                return ERR_VARIAS_NOTAS_ELIMINAR
+            unica_materia = materias[0]
+            STORE.journal_append("D", student_id, unica_materia)
+            remove_record(student_id, unica_materia)
+            STORE.mark_dirty()
     if materia:
-        log(f"ELIMINADO: ID={student_id}, Materia={materia}")
+        log("ELIMINADO: ID=%s, Materia=%s", student_id, materia)
         return {"status": "ok", "data": {"ID_Estudiante": student_id, "Materia": materia}}
     else:
-        log(f"ELIMINADO: ID={student_id}, Materia={unica_materia}")
+        log("ELIMINADO: ID=%s, Materia=%s", student_id, unica_materia)
         return {"status": "ok", "data": {"ID_Estudiante": student_id, "Materia": unica_materia}}
 
 
-def process_command(line: str) -> Dict:
+# Tabla de despacho: comando -> handler
+COMMANDS: Dict[str, Callable[[List[str]], Response]] = {
+    "AGREGAR": handle_agregar,
+    "BUSCAR": handle_buscar,
+    "ACTUALIZAR": handle_actualizar,
+    "LISTAR": handle_listar,
+    "ELIMINAR": handle_eliminar,
+}
+# Máximo de campos de un comando válido (AGREGAR)
+MAX_PARTS = 5
+
+
+def process_command(line: str) -> Response:
     line = line.strip()
-    parts = line.split("|") if line else []
-    if not parts:
-        return {"status": "error", "message": "Comando vacío"}
-
-    cmd = parts[0].upper()
-    if cmd == "AGREGAR":
-        return handle_agregar(parts)
-    if cmd == "BUSCAR":
-        return handle_buscar(parts)
-    if cmd == "ACTUALIZAR":
-        return handle_actualizar(parts)
-    if cmd == "LISTAR":
-        return handle_listar(parts)
-    if cmd == "ELIMINAR":
-        return handle_eliminar(parts)
+    if not line:
+        return ERR_VACIO
+    # maxsplit = MAX_PARTS: una línea con '|' de más conserva un campo sobrante (el handler
+    # la rechaza por formato) sin partir todo el resto del texto
+    parts = line.split("|", MAX_PARTS)
+
+    cmd = parts[0]
+    handler = COMMANDS.get(cmd)
+    if handler is None:
+        # Solo se normaliza a mayúsculas si el comando no vino ya así
+        cmd = cmd.upper()
+        handler = COMMANDS.get(cmd)
+    if handler is not None:
+        return handler(parts)
     return {"status": "error", "message": f"Comando desconocido: {cmd}"}
 
 
 def handle_client(conn: socket.socket, addr) -> None:
+    with _CONNS_LOCK:
+        _CONNS.add(conn)
+    try:
+        serve_connection(conn, addr)
+    finally:
+        with _CONNS_LOCK:
+            _CONNS.discard(conn)
+
+
+def serve_connection(conn: socket.socket, addr) -> None:
+    """Atiende las líneas que envíe el cliente (una respuesta por línea) hasta que cierre."""
     with conn:
-        log(f"Conexión de {addr}")
-        try:
-            line = recv_line(conn)
-            if line is None:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # La conexión atiende varias peticiones: keepalive detecta clientes caídos
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        log("Conexión de %s", addr)
+        # Bytes recibidos y posición de la próxima línea sin atender (se compacta al recibir)
+        buf = bytearray()
+        pos = 0
+        while True:
+            nl = buf.find(b"\n", pos)
+            deadline = None
+            while nl < 0:
+                if len(buf) - pos > MAX_LINE:
+                    log("Conexión %s cerrada: línea de más de %d bytes", addr, MAX_LINE)
+                    return
+                # El plazo de la línea corre desde su primer byte y no se renueva con cada recv
+                if deadline is None and len(buf) > pos:
+                    deadline = time.monotonic() + LINE_TIMEOUT
+                timeout = IDLE_TIMEOUT if deadline is None else deadline - time.monotonic()
+                if pos:
+                    del buf[:pos]
+                    pos = 0
+                try:
+                    if timeout <= 0:
+                        raise socket.timeout
+                    conn.settimeout(timeout)
+                    chunk = conn.recv(RECV_SIZE)
+                except socket.timeout:
+                    if deadline is None:
+                        log("Conexión %s cerrada por inactividad (%.0f s)", addr, IDLE_TIMEOUT)
+                    else:
+                        log("Conexión %s cerrada: línea incompleta tras %.0f s", addr, LINE_TIMEOUT)
+                    return
+                except OSError as e:
+                    log("Conexión %s cerrada: %s", addr, e)
+                    return
+                if not chunk:
+                    return
+                start = len(buf)
+                buf += chunk
+                nl = buf.find(b"\n", start)
+            if nl - pos > MAX_LINE:
+                log("Conexión %s cerrada: línea de más de %d bytes", addr, MAX_LINE)
                 return
-            log(f"Cmd: {line}")
-            resp = process_command(line)
-        except Exception as e:
-            resp = {"status": "error", "message": f"Excepción: {e}"}
-        payload = json.dumps(resp, ensure_ascii=False)
-        try:
-            conn.sendall((payload + "\n").encode("utf-8"))
-        except Exception as e:
-            log(f"Error enviando respuesta: {e}")
+            raw = buf[pos:nl]
+            pos = nl + 1
+            try:
+                line = raw.decode("utf-8", errors="replace")
+                log("Cmd: %s", line)
+                resp = process_command(line)
+            except Exception as e:
+                resp = {"status": "error", "message": f"Excepción: {e}"}
+            payload = encode_response(resp)
+            try:
+                conn.sendall(payload)
+            except Exception as e:
+                log("Error enviando respuesta: %s", e)
+                return
+
+
+def close_connections() -> None:
+    """Cierra las conexiones abiertas para que los hilos bloqueados en recv terminen."""
+    with _CONNS_LOCK:
+        for conn in _CONNS:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
 
 def serve_forever() -> None:
@@ -339,17 +714,25 @@ def serve_forever() -> None:
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind((HOST, PORT))
-        s.listen()
-        log(f"Servidor concurrente en {HOST}:{PORT}")
+        s.listen(LISTEN_BACKLOG)
+        log("Servidor concurrente en %s:%d", HOST, PORT)
         while True:
             conn, addr = s.accept()
-            t = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
-            t.start()
+            EXECUTOR.submit(handle_client, conn, addr)
 
 
 if __name__ == "__main__":
+    LOG_LISTENER.start()
     try:
         serve_forever()
     except KeyboardInterrupt:
+        close_connections()
+        EXECUTOR.shutdown(wait=False)
+        with CSV_LOCK.acquire_write():
+            if STORE.dirty_count:
+                STORE.compact()
         log("Servidor detenido por el usuario")
         sys.exit(0)
+    finally:
+        # Vacía la cola de logs pendientes antes de salir
+        LOG_LISTENER.stop()
@@ -9,25 +9,52 @@ Microservicio TCP de NRC (catálogo de materias por NRC).
     {"status": "not_found"}
     {"status": "error", "message": "..."}
 
+Las conexiones se mantienen abiertas (keep-alive): cada cliente puede enviar varias
+líneas por la misma conexión. Un único hilo atiende todas las conexiones con un event
+loop (selectors), así las conexiones ociosas del pool del servidor de calificaciones no
+ocupan hilos. En Linux se lanzan NUM_PROCESSES procesos que comparten un único socket de
+escucha, enlazado una sola vez por el proceso padre: si el puerto ya está en uso (otra
+instancia corriendo) el arranque falla con EADDRINUSE. Con SIGTERM el padre termina a
+sus procesos, y cada proceso sale por su cuenta si el padre muere.
+
 Lee el archivo CSV `laboratorio_2/nrcs.csv` con columnas: NRC,Materia.
 Crea el CSV con semillas si no existe.
 
 Uso:
     python3 nrcs_server.py
 
-Requisitos: Python 3.9+, librerías estándar (socket, csv, json).
+Requisitos: Python 3.9+, librerías estándar (socket, selectors, multiprocessing, signal, csv, json).
 """
 from __future__ import annotations
 
 import csv
 import json
+import multiprocessing
+import os
+import selectors
+import signal
 import socket
 import sys
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Union
 
 HOST = "127.0.0.1"
 PORT = 12346
+LISTEN_BACKLOG = 128
+ACCEPT_BATCH = 32  # accept() máximos por evento del socket de escucha
+RECV_SIZE = 65536
+# Buffer de lectura compartido: el event loop es de un solo hilo, así que se reutiliza
+# en cada recv_into en vez de asignar un bytes nuevo por lectura
+_RECV_BUF = bytearray(RECV_SIZE)
+_RECV_VIEW = memoryview(_RECV_BUF)
+# Tope de respuestas pendientes por conexión: al superarlo se dejan de atender líneas
+# y de leer hasta que flush vacíe outbuf, así un cliente que no lee no agota la memoria
+OUTBUF_HIGH_WATER = 1 << 20
+# Procesos que atienden el mismo socket de escucha (heredado con fork, solo en Linux).
+# El servicio solo lee nrcs.csv, así que cada proceso puede tener su propia caché.
+NUM_PROCESSES = (os.cpu_count() or 1) if sys.platform.startswith("linux") else 1
+# Cada cuánto (s) revisa un proceso hijo que su padre siga vivo cuando no hay actividad
+PARENT_CHECK_INTERVAL = 1.0
 
 BASE_DIR = Path(__file__).resolve().parent
 NRCS_CSV = BASE_DIR / "nrcs.csv"
@@ -41,6 +68,28 @@ SEEDS = [
     {"NRC": "BD102", "Materia": "Bases de Datos"},
 ]
 
+# Caché de nrcs.csv invalidada por mtime; se recarga solo si el archivo cambió
+_NRC_CACHE: Dict[str, object] = {"mtime": None, "map": {}}
+
+# Serializador JSON compacto creado una sola vez (sin espacios tras ',' y ':')
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+# Respuesta de process(): dict a serializar o bytes ya codificados (JSON + "\n")
+Response = Union[Dict, bytes]
+
+
+def encode_response(resp: Response) -> bytes:
+    """Serializa la respuesta como una línea JSON; las pre-codificadas se devuelven tal cual."""
+    if isinstance(resp, bytes):
+        return resp
+    return _dumps(resp).encode("utf-8") + b"\n"
+
+
+# Respuestas estáticas serializadas una sola vez
+ERR_VACIO = encode_response({"status": "error", "message": "Comando vacío"})
+ERR_FORMATO = encode_response({"status": "error", "message": "Formato: BUSCAR_NRC|{nrc}"})
+NOT_FOUND = encode_response({"status": "not_found"})
+
 
 def log(msg: str) -> None:
     print(f"[nrcs] {msg}")
@@ -57,80 +106,280 @@ def ensure_nrcs_csv_exists() -> None:
         log(f"CSV NRC creado en: {NRCS_CSV}")
 
 
+def get_nrc_map() -> Dict[str, Dict[str, str]]:
+    """Devuelve el mapa NRC -> registro cacheado; relee nrcs.csv solo si cambió su mtime."""
+    try:
+        mtime = NRCS_CSV.stat().st_mtime_ns
+    except FileNotFoundError:
+        ensure_nrcs_csv_exists()
+        mtime = NRCS_CSV.stat().st_mtime_ns
+    if _NRC_CACHE["mtime"] != mtime:
+        _NRC_CACHE["map"] = load_nrc_map()
+        _NRC_CACHE["mtime"] = mtime
+    return _NRC_CACHE["map"]  # type: ignore[return-value]
+
+
 def load_nrc_map() -> Dict[str, Dict[str, str]]:
     """Carga el CSV como mapa NRC -> registro {NRC, Materia}."""
-    ensure_nrcs_csv_exists()
     out: Dict[str, Dict[str, str]] = {}
     with NRCS_CSV.open("r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        header = next(reader, ["NRC", "Materia"])
+        i_nrc, i_mat = header.index("NRC"), header.index("Materia")
         for row in reader:
-            nrc = row.get("NRC")
-            if nrc:
-                out[nrc] = {"NRC": row.get("NRC", ""), "Materia": row.get("Materia", "")}
+            if len(row) > i_nrc and row[i_nrc]:
+                nrc = row[i_nrc]
+                out[nrc] = {"NRC": nrc, "Materia": row[i_mat] if len(row) > i_mat else ""}
     return out
 
 
-def recv_line(conn: socket.socket) -> Optional[str]:
-    buffer = bytearray()
-    while True:
-        chunk = conn.recv(1024)
-        if not chunk:
-            break
-        buffer.extend(chunk)
-        if b"\n" in chunk:
-            break
-    if not buffer:
-        return None
-    return buffer.split(b"\n", 1)[0].decode("utf-8", errors="replace")
-
-
-def process(line: str) -> Dict:
+def process(line: str) -> Response:
     line = line.strip()
-    parts = line.split("|") if line else []
-    if not parts:
-        return {"status": "error", "message": "Comando vacío"}
+    if not line:
+        return ERR_VACIO
+    # BUSCAR_NRC|{nrc}: con maxsplit=2 un '|' de más deja un tercer campo y se rechaza
+    parts = line.split("|", 2)
 
     cmd = parts[0].upper()
     if cmd != "BUSCAR_NRC" or len(parts) != 2:
-        return {"status": "error", "message": "Formato: BUSCAR_NRC|{nrc}"}
+        return ERR_FORMATO
 
     nrc = parts[1]
-    nrc_map = load_nrc_map()
+    nrc_map = get_nrc_map()
     data = nrc_map.get(nrc)
     if data:
         return {"status": "ok", "data": data}
-    return {"status": "not_found"}
+    return NOT_FOUND
 
 
-def serve_forever() -> None:
-    ensure_nrcs_csv_exists()
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+class Connection:
+    """Estado de un cliente dentro del event loop: buffers de entrada y salida."""
+
+    __slots__ = ("sock", "addr", "inbuf", "outbuf", "eof", "closed", "paused")
+
+    def __init__(self, sock: socket.socket, addr) -> None:
+        self.sock = sock
+        self.addr = addr
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.eof = False  # el cliente cerró su extremo; se cierra al vaciar outbuf
+        self.closed = False
+        # outbuf superó OUTBUF_HIGH_WATER: inbuf puede guardar líneas completas sin atender
+        self.paused = False
+
+
+def accept_connection(sel: selectors.BaseSelector, server: socket.socket) -> None:
+    """Acepta las conexiones pendientes, hasta ACCEPT_BATCH por vuelta del loop,
+    para que una ráfaga de clientes nuevos no deje esperando a los ya conectados.
+    """
+    for _ in range(ACCEPT_BATCH):
+        try:
+            conn, addr = server.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Los clientes (pool de con_hilos) mantienen la conexión abierta: keepalive detecta los caídos
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        log(f"Conexión de {addr}")
+        sel.register(conn, selectors.EVENT_READ, Connection(conn, addr))
+
+
+def close_connection(sel: selectors.BaseSelector, c: Connection) -> None:
+    if not c.closed:
+        c.closed = True
+        sel.unregister(c.sock)
+        c.sock.close()
+
+
+def respond(c: Connection, line: str) -> None:
+    """Procesa una línea y encola la respuesta JSON en el buffer de salida."""
+    log(f"Cmd: {line}")
+    try:
+        resp = process(line)
+    except Exception as e:
+        resp = {"status": "error", "message": f"Excepción: {e}"}
+    c.outbuf += encode_response(resp)
+
+
+def answer_lines(c: Connection, data, scan: int, end: int) -> int:
+    """Atiende las líneas completas de data[:end] buscando '\\n' desde scan; se detiene si
+    outbuf supera OUTBUF_HIGH_WATER. Devuelve cuántos bytes de data se consumieron.
+    """
+    start = 0
+    with memoryview(data) as view:
+        while True:
+            i = data.find(b"\n", scan, end)
+            if i < 0:
+                break
+            # Se decodifica desde la vista, sin copiar la línea a un bytes intermedio
+            respond(c, str(view[start:i], "utf-8", "replace"))
+            start = scan = i + 1
+            if len(c.outbuf) >= OUTBUF_HIGH_WATER:
+                c.paused = True
+                break
+    return start
+
+
+def on_readable(sel: selectors.BaseSelector, c: Connection) -> None:
+    """Lee lo disponible y atiende cada línea completa recibida."""
+    try:
+        n = c.sock.recv_into(_RECV_BUF)
+    except BlockingIOError:
+        return
+    except OSError as e:
+        log(f"Conexión {c.addr} cerrada: {e}")
+        close_connection(sel, c)
+        return
+    if n:
+        if c.inbuf:
+            # Lo pendiente no tiene '\n' (ya se habría atendido): se busca solo en lo nuevo
+            scan = len(c.inbuf)
+            c.inbuf += _RECV_VIEW[:n]
+            data, end = c.inbuf, len(c.inbuf)
+        else:
+            # Caso común: llegan líneas completas y se atienden directo desde _RECV_BUF
+            scan = 0
+            data, end = _RECV_BUF, n
+        start = answer_lines(c, data, scan, end)
+        # Se descarta lo ya atendido de una sola vez (no un del por línea)
+        if data is c.inbuf:
+            del c.inbuf[:start]
+        elif start < n:
+            c.inbuf += _RECV_VIEW[start:n]
+    else:
+        c.eof = True
+        if c.inbuf:
+            respond(c, c.inbuf.decode("utf-8", errors="replace"))
+            c.inbuf.clear()
+    flush(sel, c)
+
+
+def flush(sel: selectors.BaseSelector, c: Connection) -> None:
+    """Envía lo que admita el socket; si queda pendiente espera a que sea escribible.
+    Mientras la conexión está en pausa no se lee: se retoma al vaciarse outbuf.
+    """
+    while True:
+        while c.outbuf:
+            try:
+                n = c.sock.send(c.outbuf)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                log(f"Error enviando respuesta: {e}")
+                close_connection(sel, c)
+                return
+            del c.outbuf[:n]
+        if c.outbuf or not c.paused:
+            break
+        # Salida vaciada: se atienden las líneas que quedaron en inbuf
+        c.paused = False
+        del c.inbuf[: answer_lines(c, c.inbuf, 0, len(c.inbuf))]
+    events = 0 if c.eof or c.paused else selectors.EVENT_READ
+    if c.outbuf:
+        events |= selectors.EVENT_WRITE
+    if not events:
+        close_connection(sel, c)
+    elif sel.get_key(c.sock).events != events:
+        sel.modify(c.sock, events, c)
+
+
+def make_listener() -> socket.socket:
+    """Crea el socket de escucha no bloqueante. Sin SO_REUSEPORT: una segunda instancia
+    del servicio no puede enlazar el mismo puerto.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind((HOST, PORT))
-        s.listen()
-        log(f"Microservicio NRC en {HOST}:{PORT}")
+        s.listen(LISTEN_BACKLOG)
+        s.setblocking(False)
+    except OSError:
+        s.close()
+        raise
+    return s
+
+
+def serve_forever(
+    listener: Optional[socket.socket] = None, parent_pid: Optional[int] = None
+) -> None:
+    """Atiende el socket de escucha dado (o uno propio) con un event loop de selectors.
+    Con parent_pid, el loop termina en cuanto ese proceso deja de ser el padre (murió).
+    """
+    ensure_nrcs_csv_exists()
+    s = listener if listener is not None else make_listener()
+    timeout = PARENT_CHECK_INTERVAL if parent_pid is not None else None
+    with s, selectors.DefaultSelector() as sel:
+        sel.register(s, selectors.EVENT_READ, None)
+        log(f"Microservicio NRC en {HOST}:{PORT} (pid {os.getpid()})")
         while True:
-            conn, addr = s.accept()
-            with conn:
-                log(f"Conexión de {addr}")
-                try:
-                    line = recv_line(conn)
-                    if line is None:
-                        continue
-                    log(f"Cmd: {line}")
-                    resp = process(line)
-                except Exception as e:
-                    resp = {"status": "error", "message": f"Excepción: {e}"}
-                payload = json.dumps(resp, ensure_ascii=False)
-                try:
-                    conn.sendall((payload + "\n").encode("utf-8"))
-                except Exception as e:
-                    log(f"Error enviando respuesta: {e}")
+            events = sel.select(timeout)
+            if parent_pid is not None and os.getppid() != parent_pid:
+                log(f"El proceso padre {parent_pid} terminó; se cierra el proceso {os.getpid()}")
+                return
+            for key, mask in events:
+                if key.data is None:
+                    accept_connection(sel, s)
+                    continue
+                c = key.data
+                if mask & selectors.EVENT_READ:
+                    on_readable(sel, c)
+                if mask & selectors.EVENT_WRITE and not c.closed:
+                    flush(sel, c)
+
+
+def run_worker(listener: socket.socket, parent_pid: int) -> None:
+    """Punto de entrada de cada proceso: Ctrl+C lo recibe todo el grupo, se sale en silencio."""
+    try:
+        serve_forever(listener, parent_pid)
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_multiprocess(n: int) -> None:
+    """Lanza n procesos que atienden el mismo socket de escucha y espera a que terminen."""
+    # Se crea el CSV antes de lanzar los procesos para que no compitan sembrándolo
+    ensure_nrcs_csv_exists()
+    # El puerto se enlaza una sola vez, aquí: si ya está en uso falla antes de lanzar nada.
+    # Los procesos heredan el socket con fork y el kernel entrega cada conexión a uno de ellos
+    listener = make_listener()
+    ctx = multiprocessing.get_context("fork")
+    parent_pid = os.getpid()
+    procs = [
+        ctx.Process(target=run_worker, args=(listener, parent_pid), name=f"nrcs-{i}")
+        for i in range(n)
+    ]
+    try:
+        for p in procs:
+            p.start()
+    finally:
+        # El padre no atiende conexiones; los hijos tienen su propia copia del descriptor
+        listener.close()
+    # Se instala después de lanzar los procesos para que no lo hereden: un SIGTERM al padre
+    # sale del join y el finally termina a los procesos hijos en vez de dejarlos huérfanos
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    try:
+        for p in procs:
+            p.join()
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        for p in procs:
+            p.join()
+
+
+def _exit_on_sigterm(signum, frame) -> None:
+    log("NRC server detenido con SIGTERM")
+    sys.exit(0)
 
 
 if __name__ == "__main__":
     try:
-        serve_forever()
+        if NUM_PROCESSES > 1:
+            serve_multiprocess(NUM_PROCESSES)
+        else:
+            serve_forever()
     except KeyboardInterrupt:
         log("NRC server detenido por el usuario")
         sys.exit(0)
@@ -0,0 +1,293 @@
+"""
+Persistencia de calificaciones compartida por los servidores con_hilos y sin_hilos.
+
+- calificaciones.csv con encabezados: ID_Estudiante,Materia,Calificacion. AGREGAR agrega
+  una línea al final con un os.write sobre un descriptor abierto una sola vez en O_APPEND.
+- Journal calificaciones.log con los cambios aún no compactados al CSV: una línea
+  A|id|materia|cal, U|id|materia|cal o D|id|materia por cambio. Se reaplica al iniciar.
+- Compactación: tras COMPACT_THRESHOLD cambios (o al detener el servidor) el CSV se
+  reescribe completo desde el índice en un temporal que lo reemplaza, y se borra el journal.
+
+Cada servidor mantiene su propio índice en memoria; Persistencia solo lee y escribe los
+archivos. No toma locks: con_hilos la usa con CSV_LOCK tomado en modo escritura y
+sin_hilos desde su único hilo.
+
+Requisitos: Python 3.9+, librerías estándar (os, csv).
+"""
+from __future__ import annotations
+
+import csv
+import errno
+import os
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple
+
+# Fila del CSV: (ID_Estudiante, Materia, Calificacion)
+Fila = Tuple[str, str, str]
+
+# Persistimos solo ID, Materia y Calificacion; Nombre se resuelve por join con estudiantes.csv
+FIELDNAMES = ["ID_Estudiante", "Materia", "Calificacion"]
+# Líneas del journal que disparan la compactación del CSV
+COMPACT_THRESHOLD = 128
+
+# Archivos que solo crecen por append; O_BINARY evita la traducción de saltos de línea en Windows
+_APPEND_FLAGS = os.O_RDWR | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+
+
+def csv_field(value: str) -> str:
+    """Escapa un campo como csv (QUOTE_MINIMAL): solo se entrecomilla si hace falta."""
+    if "," in value or '"' in value or "\n" in value or "\r" in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def format_row(student_id: str, materia: str, calificacion: str) -> str:
+    """Formatea una fila del CSV con el mismo resultado que csv.writer (terminador \\r\\n)."""
+    return f"{csv_field(student_id)},{csv_field(materia)},{csv_field(calificacion)}\r\n"
+
+
+def format_rows(rows: List[Fila]) -> str:
+    """Formatea varias filas del CSV. Si ningún campo necesita comillas (lo normal: IDs,
+    NRCs y notas) todo se arma con str.join, que recorre las filas en C; los conteos de
+    separadores lo confirman. Si alguno las necesita, se formatea fila por fila.
+    """
+    n = len(rows)
+    body = "\r\n".join(map(",".join, rows))
+    if body.count(",") == 2 * n and '"' not in body and body.count("\n") == body.count("\r") == max(n - 1, 0):
+        return body + "\r\n" if n else ""
+    return "".join([format_row(*r) for r in rows])
+
+
+def write_durable(path: Path, data: bytes) -> None:
+    """Escribe data en path y hace fsync antes de cerrarlo. Es el punto de commit de la
+    compactación: el journal se borra después, así que el CSV nuevo debe estar en disco.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def append_line(fd: int, data: bytes) -> None:
+    """Agrega una línea completa con un solo os.write. Si falla o queda a medias (disco lleno)
+    el archivo se recorta al tamaño que tenía antes, así no queda una línea cortada que se
+    pegue a la siguiente, y se lanza OSError para que quien llama no dé el cambio por
+    persistido.
+    """
+    end = os.lseek(fd, 0, os.SEEK_END)
+    try:
+        if os.write(fd, data) != len(data):
+            raise OSError(errno.ENOSPC, "Escritura parcial", str(fd))
+    except OSError:
+        try:
+            os.ftruncate(fd, end)
+        except OSError:
+            pass
+        raise
+
+
+class Persistencia:
+    """CSV de calificaciones más su journal de cambios.
+
+    snapshot devuelve las filas actuales del índice del servidor (se usa al compactar) y
+    log es la función de log del servidor.
+    """
+
+    def __init__(self, csv_path: Path, snapshot: Callable[[], List[Fila]], log: Callable[[str], None]) -> None:
+        self.csv_path = csv_path
+        self.journal_path = csv_path.with_name("calificaciones.log")
+        self._snapshot = snapshot
+        self._log = log
+        # Descriptores del CSV y del journal abiertos en O_APPEND (se abren en el primer uso)
+        self._append_fd: Optional[int] = None
+        self._journal_fd: Optional[int] = None
+        # Líneas del journal aún no compactadas al CSV
+        self.dirty_count = 0
+
+    def ensure_header(self) -> bool:
+        """Deja el CSV con su encabezado en la primera línea: lo crea si falta y, si está
+        vacío (p. ej. tras `: > calificaciones.csv`) o su primera línea no es el encabezado,
+        lo reescribe con el encabezado delante de las filas que tenga. Sin esto read_csv
+        supondría el encabezado y los AGREGAR dejarían un archivo que no carga al reiniciar.
+        Devuelve True si tuvo que escribirlo.
+        """
+        try:
+            with self.csv_path.open("rb") as f:
+                first = f.readline()
+        except FileNotFoundError:
+            first = b""
+        columns = next(csv.reader([first.decode("utf-8", errors="replace")]), [])
+        if all(k in columns for k in FIELDNAMES):
+            return False
+        self.csv_path.parent.mkdir(parents=True, exist_ok=True)
+        rows = self.csv_path.read_bytes() if first else b""
+        tmp_path = self.csv_path.with_name(self.csv_path.name + ".tmp")
+        write_durable(tmp_path, format_row(*FIELDNAMES).encode("utf-8") + rows)
+        self._close_append()
+        os.replace(tmp_path, self.csv_path)
+        return True
+
+    def read_csv(self) -> Iterator[Fila]:
+        """Recorre las filas del CSV con una sola pasada de csv.reader; las columnas se
+        ubican por el encabezado.
+        """
+        with self.csv_path.open("r", newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader, FIELDNAMES)
+            i_id, i_mat, i_cal = (header.index(k) for k in FIELDNAMES)
+            for row in reader:
+                if len(row) > i_id and row[i_id]:
+                    materia = row[i_mat] if len(row) > i_mat else ""
+                    calificacion = row[i_cal] if len(row) > i_cal else ""
+                    yield row[i_id], materia, calificacion
+
+    def read_journal(self) -> List[List[str]]:
+        """Devuelve los cambios del journal que no alcanzaron a compactarse, ya separados
+        ([op, id, materia] o [op, id, materia, cal]), y los cuenta como pendientes.
+        Las operaciones son idempotentes, así que reaplicarlas sobre un CSV ya compactado
+        no cambia nada.
+        """
+        self._discard_torn_tail(self.journal_path)
+        try:
+            data = self.journal_path.read_bytes()
+        except FileNotFoundError:
+            data = b""
+        ops: List[List[str]] = []
+        # La cola cortada ya se recortó, así que el último elemento siempre es ""
+        for raw in data.split(b"\n")[:-1]:
+            parts = raw.decode("utf-8", errors="replace").split("|")
+            if (parts[0] in ("A", "U") and len(parts) == 4) or (parts[0] == "D" and len(parts) == 3):
+                ops.append(parts)
+        self.dirty_count = len(ops)
+        return ops
+
+    def _repair_tail(self, fd: int, path: Path) -> None:
+        """Deja path terminado en salto de línea antes de agregarle líneas.
+
+        En el journal una línea final sin salto es una escritura cortada por una caída que
+        read_journal nunca aplicó: se recorta hasta el último salto para que no se vuelva
+        válida al agregar la siguiente. El CSV en cambio puede venir editado a mano sin salto
+        final (como estudiantes.csv y nrcs.csv), así que su última fila se conserva y solo
+        se termina con \\r\\n.
+        """
+        size = end = os.lseek(fd, 0, os.SEEK_END)
+        if path == self.csv_path:
+            if size:
+                os.lseek(fd, -1, os.SEEK_END)
+                if os.read(fd, 1) != b"\n":
+                    os.write(fd, b"\r\n")
+            return
+        while end > 0:
+            start = max(0, end - 4096)
+            os.lseek(fd, start, os.SEEK_SET)
+            i = os.read(fd, end - start).rfind(b"\n")
+            if i >= 0:
+                end = start + i + 1
+                break
+            end = start
+        if end == size:
+            return
+        os.ftruncate(fd, end)
+        self._log(f"Se descartaron {size - end} bytes de una línea cortada al final de {path.name}")
+
+    def _discard_torn_tail(self, path: Path) -> None:
+        """Repara la cola de path antes de cargarlo, para que índice y disco coincidan."""
+        try:
+            fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        except FileNotFoundError:
+            return
+        try:
+            self._repair_tail(fd, path)
+        finally:
+            os.close(fd)
+
+    def _open_append_fd(self, path: Path) -> int:
+        """Abre path una sola vez en O_APPEND para escribir con os.write, sin capas de buffer."""
+        fd = os.open(path, _APPEND_FLAGS, 0o644)
+        self._repair_tail(fd, path)
+        return fd
+
+    def append_record(self, row: Fila) -> None:
+        """Escribe una sola fila al final del CSV con un os.write sobre el descriptor ya abierto."""
+        if self._append_fd is None:
+            self._append_fd = self._open_append_fd(self.csv_path)
+        try:
+            append_line(self._append_fd, format_row(*row).encode("utf-8"))
+        except OSError:
+            self._close_append()
+            raise
+
+    def persist_agregar(self, row: Fila) -> bool:
+        """Persiste un AGREGAR: al final del CSV si no hay cambios pendientes en el journal;
+        si los hay, en el journal, para que al reaplicarlo quede después de un ELIMINAR previo
+        de la misma nota. Devuelve True si fue al journal (quien llama debe hacer mark_dirty).
+        """
+        if self.dirty_count:
+            self.journal_append("A", *row)
+            return True
+        self.append_record(row)
+        return False
+
+    def journal_append(self, op: str, *fields: str) -> None:
+        """Agrega una línea OP|campo|... al journal con un solo write. No cuenta el cambio:
+        quien llama hace mark_dirty después de aplicarlo al índice, así una compactación lo
+        incluye.
+        """
+        if self._journal_fd is None:
+            self._journal_fd = self._open_append_fd(self.journal_path)
+        try:
+            append_line(self._journal_fd, ("|".join((op,) + fields) + "\n").encode("utf-8"))
+        except OSError:
+            self._close_journal()
+            raise
+
+    def mark_dirty(self) -> None:
+        """Registra un cambio pendiente y compacta el CSV al superar COMPACT_THRESHOLD.
+        El cambio ya está en el journal y en el índice, así que si la compactación falla
+        (p. ej. disco lleno) solo se registra en el log: la petición no falla y se vuelve a
+        intentar con el siguiente cambio.
+        """
+        self.dirty_count += 1
+        if self.dirty_count >= COMPACT_THRESHOLD:
+            try:
+                self.compact()
+            except OSError as e:
+                self._log(f"No se pudo compactar el CSV ({self.dirty_count} cambios siguen en el journal): {e}")
+
+    def compact(self) -> None:
+        """Reescribe el CSV completo desde el índice y descarta el journal ya volcado.
+
+        El contenido se arma en memoria y se escribe de una sola vez en un archivo temporal,
+        que luego reemplaza al CSV (os.replace) para no dejarlo a medio escribir.
+        """
+        rows = self._snapshot()
+        blob = format_row(*FIELDNAMES) + format_rows(rows)
+        tmp_path = self.csv_path.with_name(self.csv_path.name + ".tmp")
+        try:
+            write_durable(tmp_path, blob.encode("utf-8"))
+            # El descriptor de append apunta al archivo reemplazado; se reabre en el próximo AGREGAR
+            self._close_append()
+            os.replace(tmp_path, self.csv_path)
+        except OSError:
+            # El CSV y el journal siguen intactos; solo sobra el temporal a medio escribir
+            tmp_path.unlink(missing_ok=True)
+            raise
+        # Si el proceso cae entre el reemplazo del CSV y este borrado, el journal se reaplica sin efecto
+        self._close_journal()
+        self.journal_path.unlink(missing_ok=True)
+        self._log(f"CSV compactado: {len(rows)} notas ({self.dirty_count} cambios volcados)")
+        self.dirty_count = 0
+
+    def _close_append(self) -> None:
+        if self._append_fd is not None:
+            os.close(self._append_fd)
+            self._append_fd = None
+
+    def _close_journal(self) -> None:
+        if self._journal_fd is not None:
+            os.close(self._journal_fd)
+            self._journal_fd = None
@@ -17,6 +17,7 @@ Asegúrate de tener el servidor corriendo en 127.0.0.1:12345.
 """
 from __future__ import annotations
 
+import csv
 import json
 import socket
 from pathlib import Path
@@ -26,25 +27,31 @@ HOST = "127.0.0.1"
 PORT = 12345
 ESTUDIANTES_CSV = Path(__file__).resolve().parents[1] / "estudiantes.csv"
 
+# Caché de estudiantes.csv invalidada por mtime
+_EST_CACHE: Dict[str, object] = {"mtime": None, "map": {}}
+
 
 def load_estudiantes_map() -> Dict[str, str]:
-    """Carga estudiantes.csv y devuelve un mapa {ID -> Nombre}."""
-    mapping: Dict[str, str] = {}
+    """Carga estudiantes.csv y devuelve un mapa {ID -> Nombre}.
+    El mapa se cachea entre iteraciones del menú y solo se relee si cambia el mtime del archivo.
+    """
     try:
-        with ESTUDIANTES_CSV.open("r", encoding="utf-8") as f:
-            # saltar encabezado
-            header = f.readline()
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                parts = line.split(",", 1)
-                if len(parts) == 2:
-                    sid, nombre = parts[0].strip(), parts[1].strip()
-                    if sid and sid != "ID_Estudiante":
-                        mapping[sid] = nombre
+        mtime = ESTUDIANTES_CSV.stat().st_mtime_ns
+        if _EST_CACHE["mtime"] == mtime:
+            return _EST_CACHE["map"]  # type: ignore[return-value]
+        mapping: Dict[str, str] = {}
+        with ESTUDIANTES_CSV.open("r", newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                sid = (row.get("ID_Estudiante") or "").strip()
+                if sid:
+                    mapping[sid] = (row.get("Nombre") or "").strip()
     except FileNotFoundError:
         print("[client] Advertencia: estudiantes.csv no encontrado. Asegúrate de crearlo y poblarlo.")
+        _EST_CACHE["mtime"] = None
+        return {}
+    _EST_CACHE["map"] = mapping
+    _EST_CACHE["mtime"] = mtime
     return mapping
 
 
@@ -53,17 +60,10 @@ def send_command(cmd: str) -> Optional[dict]:
     Retorna None si ocurre algún error de conexión o parseo.
     """
     try:
-        with socket.create_connection((HOST, PORT), timeout=5) as s:
+        with socket.create_connection((HOST, PORT), timeout=5) as s, s.makefile("rb") as rfile:
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             s.sendall((cmd + "\n").encode("utf-8"))
-            # Leemos hasta el primer '\n'
-            data = b""
-            while True:
-                chunk = s.recv(1024)
-                if not chunk:
-                    break
-                data += chunk
-                if b"\n" in chunk:
-                    break
+            data = rfile.readline()
     except (ConnectionRefusedError, TimeoutError) as e:
         print(f"[client] No se pudo conectar al servidor: {e}")
         return None
@@ -75,7 +75,7 @@ def send_command(cmd: str) -> Optional[dict]:
         print("[client] Respuesta vacía del servidor")
         return None
 
-    line = data.split(b"\n", 1)[0].decode("utf-8", errors="replace")
+    line = data.decode("utf-8", errors="replace").rstrip("\n")
     try:
         return json.loads(line)
     except json.JSONDecodeError as e:
@@ -8,48 +8,89 @@ Servidor TCP secuencial (sin hilos) para gestionar calificaciones.
   LISTAR
   ELIMINAR|{id}
 
-- Respuestas como JSON (dicts serializados) terminadas en \n.
+- Respuestas como JSON (dicts serializados) terminadas en \n; un cliente puede enviar
+  varias líneas por conexión.
+- Un solo hilo: un event loop con selectors multiplexa las conexiones (sockets no
+  bloqueantes) y los comandos se procesan de a uno, así un cliente lento no bloquea al resto.
 - Persistencia en CSV con encabezados: ID_Estudiante,Nombre,Materia,Calificacion
+- Índice en memoria (NOTAS / NOTAS_POR_ID) cargado una vez al iniciar: BUSCAR y LISTAR no
+  leen el CSV; cada cambio se persiste junto con el índice y, si la escritura falla, el
+  índice queda como estaba (AGREGAR agrega una línea al final; ACTUALIZAR/ELIMINAR agregan
+  una línea al journal calificaciones.log, que se aplica al iniciar). El CSV se reescribe
+  completo tras COMPACT_THRESHOLD cambios o al detener el servidor, y entonces se borra el
+  journal. La escritura de CSV y journal está en persistencia.py, compartido con con_hilos.
 
 Uso:
     python3 server.py
 
-Requisitos: Python 3.9+, librerías estándar (socket, csv, json).
+Requisitos: Python 3.9+, librerías estándar (socket, selectors, csv, json).
+  Si orjson está instalado se usa para serializar las respuestas; si no, json.
 """
 from __future__ import annotations
 
 import csv
 import json
 import os
+import selectors
 import socket
 import sys
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+# persistencia.py está en la carpeta del laboratorio, junto a nrcs_server.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from persistencia import Persistencia  # noqa: E402
 
 HOST = "127.0.0.1"  # localhost
 PORT = 12345
+LISTEN_BACKLOG = 128
+ACCEPT_BATCH = 32  # accept() máximos por evento del socket de escucha
+RECV_SIZE = 65536
+# Buffer de lectura compartido: el event loop es de un solo hilo, así que se reutiliza
+# en cada recv_into en vez de asignar un bytes nuevo por lectura
+_RECV_BUF = bytearray(RECV_SIZE)
+_RECV_VIEW = memoryview(_RECV_BUF)
+# Tope de respuestas pendientes por conexión: al superarlo se dejan de atender líneas
+# y de leer hasta que flush vacíe outbuf, así un cliente que no lee no agota la memoria
+OUTBUF_HIGH_WATER = 1 << 20
 
 # Ruta del CSV: laboratorio_2/calificaciones.csv
 CSV_PATH = Path(__file__).resolve().parents[1] / "calificaciones.csv"
-# Ahora persistimos solo ID, Materia, Calificacion (el Nombre se resuelve por join)
-FIELDNAMES = ["ID_Estudiante", "Materia", "Calificacion"]
 ESTUDIANTES_CSV = Path(__file__).resolve().parents[1] / "estudiantes.csv"
 ESTUDIANTES_FIELDS = ["ID_Estudiante", "Nombre"]
 
+# Índice en memoria de calificaciones; se carga una vez al iniciar y todas las lecturas salen
+# de aquí (el servidor secuencial es el único escritor del CSV). El orden de inserción de
+# NOTAS es el orden del CSV.
+NOTAS: Dict[Tuple[str, str], str] = {}  # (ID_Estudiante, Materia) -> Calificacion
+NOTAS_POR_ID: Dict[str, List[str]] = {}  # ID_Estudiante -> materias, en orden
+_NOTAS_LOADED = False
+# Respuesta de LISTAR ya serializada: (mapa de estudiantes usado, bytes); add_nota y
+# remove_nota la invalidan
+_LISTAR_CACHE: Optional[Tuple[Dict[str, str], bytes]] = None
+
+# Caché de estudiantes.csv: se relee solo si cambia su mtime
+_EST_CACHE: Dict[str, object] = {"mtime": None, "map": {}}
+
 
 def log(msg: str) -> None:
     """Imprime logs simples en stdout (se puede reemplazar por logging si se desea)."""
     print(f"[server] {msg}")
 
 
+# CSV y journal en disco (persistencia.py, compartido con con_hilos)
+STORE = Persistencia(CSV_PATH, lambda: [key + (cal,) for key, cal in NOTAS.items()], log)
+
+
 def ensure_csv_exists() -> None:
-    """Crea el archivo CSV con encabezados si no existe."""
-    if not CSV_PATH.exists():
-        CSV_PATH.parent.mkdir(parents=True, exist_ok=True)
-        with CSV_PATH.open("w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-            writer.writeheader()
-        log(f"CSV creado en: {CSV_PATH}")
+    """Crea el archivo CSV con encabezados si no existe (o se los agrega si está vacío) y
+    carga el índice (solo la primera vez).
+    """
+    if _NOTAS_LOADED:
+        return
+    if STORE.ensure_header():
+        log(f"Encabezado del CSV escrito en: {CSV_PATH}")
+    load_notas()
 
 
 def ensure_estudiantes_csv_exists() -> None:
@@ -62,111 +103,200 @@ def ensure_estudiantes_csv_exists() -> None:
         log(f"CSV estudiantes creado en: {ESTUDIANTES_CSV}")
 
 
-def load_records() -> List[Dict[str, str]]:
-    """Carga todos los registros del CSV como lista de dicts (strings)."""
-    ensure_csv_exists()
-    with CSV_PATH.open("r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        return list(reader)
-
-
-def save_records(records: List[Dict[str, str]]) -> None:
-    """Sobrescribe el CSV con la lista de registros dada."""
-    with CSV_PATH.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-        writer.writeheader()
-        writer.writerows(records)
+def load_notas() -> None:
+    """Llena NOTAS y NOTAS_POR_ID con una sola pasada por el CSV usando csv.reader."""
+    global _NOTAS_LOADED
+    NOTAS.clear()
+    NOTAS_POR_ID.clear()
+    for sid, materia, calificacion in STORE.read_csv():
+        add_nota(sid, materia, calificacion)
+    applied = replay_journal()
+    _NOTAS_LOADED = True
+    log(f"Índice cargado: {len(NOTAS)} notas ({applied} cambios del journal)")
 
 
-def get_estudiante_nombre(student_id: str) -> Optional[str]:
-    """Lee estudiantes.csv y devuelve el nombre del estudiante si existe, sino None."""
-    ensure_estudiantes_csv_exists()
-    with ESTUDIANTES_CSV.open("r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row.get("ID_Estudiante") == student_id:
-                return row.get("Nombre") or ""
-    return None
+def replay_journal() -> int:
+    """Aplica sobre el índice los cambios del journal que no alcanzaron a compactarse.
+    Devuelve cuántas líneas se aplicaron.
+    """
+    ops = STORE.read_journal()
+    for parts in ops:
+        if parts[0] == "D":
+            if (parts[1], parts[2]) in NOTAS:
+                remove_nota(parts[1], parts[2])
+        else:
+            add_nota(parts[1], parts[2], parts[3])
+    return len(ops)
+
+
+def add_nota(student_id: str, materia: str, calificacion: str) -> None:
+    global _LISTAR_CACHE
+    _LISTAR_CACHE = None
+    if (student_id, materia) not in NOTAS:
+        NOTAS_POR_ID.setdefault(student_id, []).append(materia)
+    NOTAS[(student_id, materia)] = calificacion
+
+
+def insert_nota(student_id: str, materia: str, calificacion: str) -> bool:
+    """Inserta la nota solo si (ID, Materia) no existe, con una sola búsqueda en NOTAS
+    (setdefault). Devuelve False si ya existía.
+    """
+    global _LISTAR_CACHE
+    n = len(NOTAS)
+    NOTAS.setdefault((student_id, materia), calificacion)
+    if len(NOTAS) == n:
+        return False
+    NOTAS_POR_ID.setdefault(student_id, []).append(materia)
+    _LISTAR_CACHE = None
+    return True
+
+
+def remove_nota(student_id: str, materia: str) -> None:
+    global _LISTAR_CACHE
+    _LISTAR_CACHE = None
+    del NOTAS[(student_id, materia)]
+    materias = NOTAS_POR_ID[student_id]
+    materias.remove(materia)
+    if not materias:
+        del NOTAS_POR_ID[student_id]
+
+
+def fila(student_id: str, materia: str, calificacion: str) -> Dict[str, str]:
+    """Arma la fila como dict solo al construir la respuesta JSON."""
+    return {"ID_Estudiante": student_id, "Materia": materia, "Calificacion": calificacion}
+
+
+def get_estudiantes_map() -> Dict[str, str]:
+    """Devuelve el mapa {ID_Estudiante -> Nombre} cacheado.
+    Solo vuelve a leer estudiantes.csv cuando cambia su mtime; si no existe lo crea.
+    """
+    try:
+        mtime = ESTUDIANTES_CSV.stat().st_mtime_ns
+    except FileNotFoundError:
+        ensure_estudiantes_csv_exists()
+        mtime = ESTUDIANTES_CSV.stat().st_mtime_ns
+    if _EST_CACHE["mtime"] != mtime:
+        _EST_CACHE["map"] = load_estudiantes_map()
+        _EST_CACHE["mtime"] = mtime
+    return _EST_CACHE["map"]  # type: ignore[return-value]
 
 
 def load_estudiantes_map() -> Dict[str, str]:
-    """Devuelve un mapa {ID_Estudiante -> Nombre} desde estudiantes.csv."""
-    ensure_estudiantes_csv_exists()
+    """Lee estudiantes.csv y construye un mapa {ID_Estudiante -> Nombre}."""
     out: Dict[str, str] = {}
     with ESTUDIANTES_CSV.open("r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        header = next(reader, ["ID_Estudiante", "Nombre"])
+        i_id, i_nom = header.index("ID_Estudiante"), header.index("Nombre")
         for row in reader:
-            sid = row.get("ID_Estudiante")
-            if sid:
-                out[sid] = row.get("Nombre") or ""
+            if len(row) > i_id and row[i_id]:
+                out[row[i_id]] = row[i_nom] if len(row) > i_nom else ""
     return out
 
 
 def find_by_id(student_id: str) -> Optional[Dict[str, str]]:
     """Busca un registro por ID_Estudiante. Devuelve el dict o None si no existe."""
-    for row in load_records():
-        if row.get("ID_Estudiante") == student_id:
-            return row
-    return None
+    ensure_csv_exists()
+    materias = NOTAS_POR_ID.get(student_id)
+    if not materias:
+        return None
+    return fila(student_id, materias[0], NOTAS[(student_id, materias[0])])
+
+
+# Serializador JSON compacto creado una sola vez (sin espacios tras ',' y ':'). Con orjson
+# instalado se usa ese: produce los mismos bytes UTF-8 compactos en código nativo
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+# Respuesta de un handler: dict a serializar o bytes ya codificados (JSON + "\n")
+Response = Union[Dict, bytes]
+
+
+def encode_response(resp: Response) -> bytes:
+    """Serializa la respuesta como una línea JSON; las pre-codificadas se devuelven tal cual."""
+    if isinstance(resp, bytes):
+        return resp
+    if orjson is not None:
+        return orjson.dumps(resp, option=orjson.OPT_APPEND_NEWLINE)
+    return _dumps(resp).encode("utf-8") + b"\n"
 
 
-def handle_agregar(parts: List[str]) -> Dict:
+# Respuestas estáticas serializadas una sola vez; los handlers las devuelven tal cual
+ERR_VACIO = encode_response({"status": "error", "message": "Comando vacío"})
+ERR_FORMATO_AGREGAR = encode_response({"status": "error", "message": "Formato inválido para AGREGAR. Usa: AGREGAR|ID|Materia|Calificacion"})
+ERR_FORMATO_BUSCAR = encode_response({"status": "error", "message": "Formato inválido para BUSCAR"})
+ERR_FORMATO_ACTUALIZAR = encode_response({"status": "error", "message": "Formato inválido para ACTUALIZAR (use ID|nueva o ID|Materia|nueva)"})
+ERR_FORMATO_LISTAR = encode_response({"status": "error", "message": "Formato inválido para LISTAR"})
+ERR_FORMATO_ELIMINAR = encode_response({"status": "error", "message": "Formato inválido para ELIMINAR (use ID o ID|Materia)"})
+ERR_ID_VACIO = encode_response({"status": "error", "message": "ID_Estudiante vacío"})
+ERR_ESTUDIANTE_NO_EXISTE = encode_response({"status": "error", "message": "ID_Estudiante no encontrado en estudiantes.csv"})
+ERR_NOTA_EXISTE = encode_response({"status": "error", "message": "La nota para ese ID y Materia ya existe"})
+ERR_VARIAS_NOTAS_ACTUALIZAR = encode_response({"status": "error", "message": "El ID tiene varias notas; use ACTUALIZAR|ID|Materia|nueva"})
+ERR_VARIAS_NOTAS_ELIMINAR = encode_response({"status": "error", "message": "El ID tiene varias notas; especifique Materia (ELIMINAR|ID|Materia)"})
+NOT_FOUND_ID = encode_response({"status": "not_found", "message": "No existe el ID"})
+NOT_FOUND_NOTA = encode_response({"status": "not_found", "message": "No existe nota para ese ID y Materia"})
+
+
+def handle_agregar(parts: List[str]) -> Response:
     """AGREGAR|{id}|{materia}|{calificacion}"""
     if len(parts) != 4:
-        return {"status": "error", "message": "Formato inválido para AGREGAR. Usa: AGREGAR|ID|Materia|Calificacion"}
+        return ERR_FORMATO_AGREGAR
 
     student_id, materia, calificacion = parts[1], parts[2], parts[3]
 
     # Validación simple de ID y calificación
     if not student_id:
-        return {"status": "error", "message": "ID_Estudiante vacío"}
+        return ERR_ID_VACIO
 
     # Validar existencia en estudiantes.csv y usar nombre canónico
-    nombre_canonico = get_estudiante_nombre(student_id)
+    nombre_canonico = get_estudiantes_map().get(student_id)
     if nombre_canonico is None:
-        return {"status": "error", "message": "ID_Estudiante no encontrado en estudiantes.csv"}
-
-    records = load_records()
-    # Unicidad por par (ID_Estudiante, Materia)
-    if any(r["ID_Estudiante"] == student_id and r.get("Materia") == materia for r in records):
-        return {"status": "error", "message": "La nota para ese ID y Materia ya existe"}
+        return ERR_ESTUDIANTE_NO_EXISTE
 
+    ensure_csv_exists()
+    # Unicidad por par (ID_Estudiante, Materia): se verifica e inserta en un solo paso
+    if not insert_nota(student_id, materia, calificacion):
+        return ERR_NOTA_EXISTE
+    try:
+        journaled = STORE.persist_agregar((student_id, materia, calificacion))
+    except OSError:
+        # La fila no llegó a disco: se deshace la inserción para que el índice no diverja
+        remove_nota(student_id, materia)
+        raise
+    if journaled:
+        STORE.mark_dirty()
     # Persistimos sin el campo Nombre
-    new_row = {
-        "ID_Estudiante": student_id,
-        "Materia": materia,
-        "Calificacion": calificacion,
-    }
-    records.append(new_row)
-    save_records(records)
+    new_row = fila(student_id, materia, calificacion)
     log(f"AGREGADO: {new_row} (nombre canónico: {nombre_canonico})")
     # Responder incluyendo el nombre canónico para comodidad del cliente
-    resp_data = dict(new_row)
-    resp_data["Nombre"] = nombre_canonico
-    return {"status": "ok", "data": resp_data}
+    new_row["Nombre"] = nombre_canonico
+    return {"status": "ok", "data": new_row}
 
 
-def handle_buscar(parts: List[str]) -> Dict:
+def handle_buscar(parts: List[str]) -> Response:
     """BUSCAR|{id}"""
     if len(parts) != 2:
-        return {"status": "error", "message": "Formato inválido para BUSCAR"}
+        return ERR_FORMATO_BUSCAR
     student_id = parts[1]
+    ensure_csv_exists()
     # Devolver todas las notas del estudiante
-    rows = [r for r in load_records() if r.get("ID_Estudiante") == student_id]
-    if not rows:
-        return {"status": "not_found", "message": "No existe el ID"}
-    est_map = load_estudiantes_map()
+    materias = NOTAS_POR_ID.get(student_id)
+    if not materias:
+        return NOT_FOUND_ID
+    rows = [fila(student_id, m, NOTAS[(student_id, m)]) for m in materias]
+    est_map = get_estudiantes_map()
     nombre_canon = est_map.get(student_id)
-    enriched: List[Dict[str, str]] = []
-    for r in rows:
-        rr = dict(r)
-        if nombre_canon:
-            rr["Nombre"] = nombre_canon
-        enriched.append(rr)
-    return {"status": "ok", "data": enriched}
+    if nombre_canon:
+        for r in rows:
+            r["Nombre"] = nombre_canon
+    return {"status": "ok", "data": rows}
 
 
-def handle_actualizar(parts: List[str]) -> Dict:
+def handle_actualizar(parts: List[str]) -> Response:
     """ACTUALIZAR|{id}|{nueva_calificacion} o ACTUALIZAR|{id}|{materia}|{nueva_calificacion}
 
     - Si se especifica materia, actualiza solo esa nota.
@@ -174,60 +304,55 @@ def handle_actualizar(parts: List[str]) -> Dict:
       Si hay 0 → not_found; si hay >1 → error pidiendo materia.
     """
     if len(parts) not in (3, 4):
-        return {"status": "error", "message": "Formato inválido para ACTUALIZAR (use ID|nueva o ID|Materia|nueva)"}
+        return ERR_FORMATO_ACTUALIZAR
 
     student_id = parts[1]
+    ensure_csv_exists()
     if len(parts) == 4:
         materia, nueva_cal = parts[2], parts[3]
-        records = load_records()
-        updated = False
-        for r in records:
-            if r["ID_Estudiante"] == student_id and r.get("Materia") == materia:
-                r["Calificacion"] = nueva_cal
-                updated = True
-                break
-        if not updated:
-            return {"status": "not_found", "message": "No existe nota para ese ID y Materia"}
-        save_records(records)
-        log(f"ACTUALIZADO: ID={student_id}, Materia={materia}, nueva_cal={nueva_cal}")
-        return {"status": "ok", "data": {"ID_Estudiante": student_id, "Materia": materia, "Calificacion": nueva_cal}}
+        if (student_id, materia) not in NOTAS:
+            return NOT_FOUND_NOTA
     else:
         nueva_cal = parts[2]
-        records = load_records()
-        notas_id = [r for r in records if r.get("ID_Estudiante") == student_id]
-        if not notas_id:
-            return {"status": "not_found", "message": "No existe el ID"}
-        if len(notas_id) > 1:
-            return {"status": "error", "message": "El ID tiene varias notas; use ACTUALIZAR|ID|Materia|nueva"}
-        materia = notas_id[0].get("Materia")
-        for r in records:
-            if r["ID_Estudiante"] == student_id and r.get("Materia") == materia:
-                r["Calificacion"] = nueva_cal
-                break
-        save_records(records)
-        log(f"ACTUALIZADO: ID={student_id}, Materia={materia}, nueva_cal={nueva_cal}")
-        return {"status": "ok", "data": {"ID_Estudiante": student_id, "Materia": materia, "Calificacion": nueva_cal}}
-
-
-def handle_listar(parts: List[str]) -> Dict:
+        materias = NOTAS_POR_ID.get(student_id)
+        if not materias:
+            return NOT_FOUND_ID
+        if len(materias) > 1:
+            return ERR_VARIAS_NOTAS_ACTUALIZAR
+        materia = materias[0]
+    # Primero a disco: si el write falla, el índice queda como estaba
+    STORE.journal_append("U", student_id, materia, nueva_cal)
+    add_nota(student_id, materia, nueva_cal)
+    STORE.mark_dirty()
+    log(f"ACTUALIZADO: ID={student_id}, Materia={materia}, nueva_cal={nueva_cal}")
+    return {"status": "ok", "data": fila(student_id, materia, nueva_cal)}
+
+
+def handle_listar(parts: List[str]) -> Response:
     """LISTAR"""
     if len(parts) != 1:
-        return {"status": "error", "message": "Formato inválido para LISTAR"}
-    rows = load_records()
+        return ERR_FORMATO_LISTAR
+    global _LISTAR_CACHE
+    ensure_csv_exists()
     # Join con estudiantes.csv para devolver nombre canónico
-    est_map = load_estudiantes_map()
-    enriched: List[Dict[str, str]] = []
-    for r in rows:
-        rr = dict(r)
-        sid = rr.get("ID_Estudiante", "")
+    est_map = get_estudiantes_map()
+    # Sin cambios en el índice ni en estudiantes.csv (mismo dict cacheado) se reenvía la
+    # respuesta ya serializada
+    if _LISTAR_CACHE is not None and _LISTAR_CACHE[0] is est_map:
+        return _LISTAR_CACHE[1]
+    rows: List[Dict[str, str]] = []
+    for (sid, materia), cal in NOTAS.items():
+        r = fila(sid, materia, cal)
         nombre_canon = est_map.get(sid)
         if nombre_canon:
-            rr["Nombre"] = nombre_canon
-        enriched.append(rr)
-    return {"status": "ok", "data": enriched}
+            r["Nombre"] = nombre_canon
+        rows.append(r)
+    payload = encode_response({"status": "ok", "data": rows})
+    _LISTAR_CACHE = (est_map, payload)
+    return payload
 
 
-def handle_eliminar(parts: List[str]) -> Dict:
+def handle_eliminar(parts: List[str]) -> Response:
     """ELIMINAR|{id}|{materia}
 
     Comportamiento:
@@ -236,111 +361,244 @@ def handle_eliminar(parts: List[str]) -> Dict:
       Si hay 0 notas → not_found; si hay >1 notas → error pidiendo especificar materia.
     """
     if len(parts) not in (2, 3):
-        return {"status": "error", "message": "Formato inválido para ELIMINAR (use ID o ID|Materia)"}
+        return ERR_FORMATO_ELIMINAR
 
     student_id = parts[1]
     materia = parts[2] if len(parts) == 3 else None
-    records = load_records()
+    ensure_csv_exists()
 
     if materia:
         # Eliminar solo la nota específica
-        new_records = [r for r in records if not (r.get("ID_Estudiante") == student_id and r.get("Materia") == materia)]
-        if len(new_records) == len(records):
-            return {"status": "not_found", "message": "No existe nota para ese ID y Materia"}
-        save_records(new_records)
-        log(f"ELIMINADO: ID={student_id}, Materia={materia}")
-        return {"status": "ok", "data": {"ID_Estudiante": student_id, "Materia": materia}}
+        if (student_id, materia) not in NOTAS:
+            return NOT_FOUND_NOTA
     else:
         # Sin materia: decidir según cuántas notas tiene el ID
-        notas_id = [r for r in records if r.get("ID_Estudiante") == student_id]
-        if not notas_id:
-            return {"status": "not_found", "message": "No existe el ID"}
-        if len(notas_id) > 1:
-            return {"status": "error", "message": "El ID tiene varias notas; especifique Materia (ELIMINAR|ID|Materia)"}
+        materias = NOTAS_POR_ID.get(student_id)
+        if not materias:
+            return NOT_FOUND_ID
+        if len(materias) > 1:
+            return ERR_VARIAS_NOTAS_ELIMINAR
         # Tiene exactamente una nota: elimínala
-        unica_materia = notas_id[0].get("Materia")
-        new_records = [r for r in records if not (r.get("ID_Estudiante") == student_id and r.get("Materia") == unica_materia)]
-        save_records(new_records)
-        log(f"ELIMINADO: ID={student_id}, Materia={unica_materia}")
-        return {"status": "ok", "data": {"ID_Estudiante": student_id, "Materia": unica_materia}}
-
-
-def process_command(line: str) -> Dict:
-    """Procesa una línea de comando y devuelve la respuesta (dict)."""
+        materia = materias[0]
+    # Primero a disco: si el write falla, el índice queda como estaba
+    STORE.journal_append("D", student_id, materia)
+    remove_nota(student_id, materia)
+    STORE.mark_dirty()
+    log(f"ELIMINADO: ID={student_id}, Materia={materia}")
+    return {"status": "ok", "data": {"ID_Estudiante": student_id, "Materia": materia}}
+
+
+# Tabla de despacho: comando -> handler
+COMMANDS: Dict[str, Callable[[List[str]], Response]] = {
+    "AGREGAR": handle_agregar,
+    "BUSCAR": handle_buscar,
+    "ACTUALIZAR": handle_actualizar,
+    "LISTAR": handle_listar,
+    "ELIMINAR": handle_eliminar,
+}
+# Máximo de campos de un comando válido (AGREGAR)
+MAX_PARTS = 4
+
+
+def process_command(line: str) -> Response:
+    """Procesa una línea de comando y devuelve la respuesta (dict o bytes pre-codificados)."""
     line = line.strip()
-    parts = line.split("|") if line else []
-    if not parts:
-        return {"status": "error", "message": "Comando vacío"}
-
-    cmd = parts[0].upper()
-    if cmd == "AGREGAR":
-        return handle_agregar(parts)
-    if cmd == "BUSCAR":
-        return handle_buscar(parts)
-    if cmd == "ACTUALIZAR":
-        return handle_actualizar(parts)
-    if cmd == "LISTAR":
-        return handle_listar(parts)
-    if cmd == "ELIMINAR":
-        return handle_eliminar(parts)
+    if not line:
+        return ERR_VACIO
+    # maxsplit = MAX_PARTS: una línea con '|' de más conserva un campo sobrante (el handler
+    # la rechaza por formato) sin partir todo el resto del texto
+    parts = line.split("|", MAX_PARTS)
+
+    cmd = parts[0]
+    handler = COMMANDS.get(cmd)
+    if handler is None:
+        # Solo se normaliza a mayúsculas si el comando no vino ya así
+        cmd = cmd.upper()
+        handler = COMMANDS.get(cmd)
+    if handler is not None:
+        return handler(parts)
 
     return {"status": "error", "message": f"Comando desconocido: {cmd}"}
 
 
-def recv_line(conn: socket.socket) -> Optional[str]:
-    """Lee desde el socket hasta encontrar un '\n' o cierre de conexión.
-    Devuelve la línea (incluye datos antes de '\n') o None si no hay datos.
+class Connection:
+    """Estado de un cliente dentro del event loop: buffers de entrada y salida."""
+
+    __slots__ = ("sock", "addr", "inbuf", "outbuf", "eof", "closed", "paused")
+
+    def __init__(self, sock: socket.socket, addr) -> None:
+        self.sock = sock
+        self.addr = addr
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.eof = False  # el cliente cerró su extremo; se cierra al vaciar outbuf
+        self.closed = False
+        # outbuf superó OUTBUF_HIGH_WATER: inbuf puede guardar líneas completas sin atender
+        self.paused = False
+
+
+def accept_connection(sel: selectors.BaseSelector, server: socket.socket) -> None:
+    """Acepta las conexiones pendientes, hasta ACCEPT_BATCH por vuelta del loop,
+    para que una ráfaga de clientes nuevos no deje esperando a los ya conectados.
+    """
+    for _ in range(ACCEPT_BATCH):
+        try:
+            conn, addr = server.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        # Respuestas cortas: sin Nagle para no demorar el envío
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # La conexión atiende varias peticiones: keepalive detecta clientes caídos
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        log(f"Conexión de {addr}")
+        sel.register(conn, selectors.EVENT_READ, Connection(conn, addr))
+
+
+def close_connection(sel: selectors.BaseSelector, c: Connection) -> None:
+    if not c.closed:
+        c.closed = True
+        sel.unregister(c.sock)
+        c.sock.close()
+
+
+def respond(c: Connection, line: str) -> None:
+    """Procesa una línea y encola la respuesta JSON en el buffer de salida."""
+    log(f"Comando recibido: {line}")
+    try:
+        resp = process_command(line)
+    except Exception as e:
+        resp = {"status": "error", "message": f"Excepción: {e}"}
+    # Enviamos JSON + \n. Las respuestas que ya vienen en bytes (constantes y el LISTAR
+    # cacheado, que puede pesar megas) no se decodifican para el log: solo se anota su tamaño
+    if isinstance(resp, bytes):
+        c.outbuf += resp
+        log(f"Respuesta: {len(resp)} bytes pre-serializados")
+    elif orjson is not None:
+        payload = encode_response(resp)
+        c.outbuf += payload
+        # Las respuestas armadas por comando son cortas: decodificarlas para el log es barato
+        log(f"Respuesta: {payload[:-1].decode('utf-8')}")
+    else:
+        # Con json se reutiliza el texto ya serializado para el log
+        texto = _dumps(resp)
+        c.outbuf += texto.encode("utf-8") + b"\n"
+        log(f"Respuesta: {texto}")
+
+
+def answer_lines(c: Connection, data, scan: int, end: int) -> int:
+    """Atiende las líneas completas de data[:end] buscando '\\n' desde scan; se detiene si
+    outbuf supera OUTBUF_HIGH_WATER. Devuelve cuántos bytes de data se consumieron.
+    """
+    start = 0
+    with memoryview(data) as view:
+        while True:
+            i = data.find(b"\n", scan, end)
+            if i < 0:
+                break
+            # Se decodifica desde la vista, sin copiar la línea a un bytes intermedio
+            respond(c, str(view[start:i], "utf-8", "replace"))
+            start = scan = i + 1
+            if len(c.outbuf) >= OUTBUF_HIGH_WATER:
+                c.paused = True
+                break
+    return start
+
+
+def on_readable(sel: selectors.BaseSelector, c: Connection) -> None:
+    """Lee lo disponible y atiende cada línea completa recibida."""
+    try:
+        n = c.sock.recv_into(_RECV_BUF)
+    except BlockingIOError:
+        return
+    except OSError as e:
+        log(f"Conexión {c.addr} cerrada: {e}")
+        close_connection(sel, c)
+        return
+    if n:
+        if c.inbuf:
+            # Lo pendiente no tiene '\n' (ya se habría atendido): se busca solo en lo nuevo
+            scan = len(c.inbuf)
+            c.inbuf += _RECV_VIEW[:n]
+            data, end = c.inbuf, len(c.inbuf)
+        else:
+            # Caso común: llegan líneas completas y se atienden directo desde _RECV_BUF
+            scan = 0
+            data, end = _RECV_BUF, n
+        start = answer_lines(c, data, scan, end)
+        # Se descarta lo ya atendido de una sola vez (no un del por línea)
+        if data is c.inbuf:
+            del c.inbuf[:start]
+        elif start < n:
+            c.inbuf += _RECV_VIEW[start:n]
+    else:
+        c.eof = True
+        # Una última línea sin '\n' antes del cierre también se atiende
+        if c.inbuf:
+            respond(c, c.inbuf.decode("utf-8", errors="replace"))
+            c.inbuf.clear()
+    flush(sel, c)
+
+
+def flush(sel: selectors.BaseSelector, c: Connection) -> None:
+    """Envía lo que admita el socket; si queda pendiente espera a que sea escribible.
+    Mientras la conexión está en pausa no se lee: se retoma al vaciarse outbuf.
     """
-    buffer = bytearray()
     while True:
-        chunk = conn.recv(1024)
-        if not chunk:
-            break
-        buffer.extend(chunk)
-        if b"\n" in chunk:
+        while c.outbuf:
+            try:
+                n = c.sock.send(c.outbuf)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                log(f"Error enviando respuesta: {e}")
+                close_connection(sel, c)
+                return
+            del c.outbuf[:n]
+        if c.outbuf or not c.paused:
             break
-    if not buffer:
-        return None
-    # Consideramos solo hasta el primer salto de línea
-    line = buffer.split(b"\n", 1)[0].decode("utf-8", errors="replace")
-    return line
+        # Salida vaciada: se atienden las líneas que quedaron en inbuf
+        c.paused = False
+        del c.inbuf[: answer_lines(c, c.inbuf, 0, len(c.inbuf))]
+    events = 0 if c.eof or c.paused else selectors.EVENT_READ
+    if c.outbuf:
+        events |= selectors.EVENT_WRITE
+    if not events:
+        close_connection(sel, c)
+    elif sel.get_key(c.sock).events != events:
+        sel.modify(c.sock, events, c)
 
 
 def serve_forever() -> None:
-    """Inicia el servidor TCP secuencial y atiende clientes de a uno por vez."""
+    """Inicia el servidor TCP sin hilos: un único event loop (selectors) atiende a todos
+    los clientes y procesa sus comandos de a uno por vez.
+    """
     ensure_csv_exists()
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s, selectors.DefaultSelector() as sel:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind((HOST, PORT))
-        s.listen()
+        s.listen(LISTEN_BACKLOG)
+        s.setblocking(False)
+        sel.register(s, selectors.EVENT_READ, None)
         log(f"Servidor escuchando en {HOST}:{PORT} (secuencial)")
 
         while True:
-            conn, addr = s.accept()
-            with conn:
-                log(f"Conexión de {addr}")
-                try:
-                    line = recv_line(conn)
-                    if line is None:
-                        log("Cliente cerró sin enviar datos")
-                        continue
-                    log(f"Comando recibido: {line}")
-                    resp = process_command(line)
-                except Exception as e:
-                    resp = {"status": "error", "message": f"Excepción: {e}"}
-
-                # Enviamos JSON + \n
-                payload = json.dumps(resp, ensure_ascii=False)
-                try:
-                    conn.sendall((payload + "\n").encode("utf-8"))
-                except Exception as e:
-                    log(f"Error enviando respuesta: {e}")
-                log(f"Respuesta enviada: {resp}")
+            for key, mask in sel.select():
+                if key.data is None:
+                    accept_connection(sel, s)
+                    continue
+                c = key.data
+                if mask & selectors.EVENT_READ:
+                    on_readable(sel, c)
+                if mask & selectors.EVENT_WRITE and not c.closed:
+                    flush(sel, c)
 
 
 if __name__ == "__main__":
     try:
         serve_forever()
     except KeyboardInterrupt:
+        if STORE.dirty_count:
+            STORE.compact()
         log("Servidor detenido por el usuario (Ctrl+C)")
         sys.exit(0)